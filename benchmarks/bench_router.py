@@ -0,0 +1,67 @@
+# Derek Santos
+""" Micro-benchmark for router.classify against the old per-call regex scan.
+
+    python benchmarks/bench_router.py [NUMBER_OF_URLS]
+"""
+import os
+import random
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'imgurtofolder'))
+
+import router
+
+URL_TEMPLATES = [
+    'https://imgur.com/a/{id}',
+    'https://imgur.com/gallery/{id}',
+    'https://imgur.com/g/{id}',
+    'https://imgur.com/r/pics/{id}',
+    'https://imgur.com/r/{id}',
+    'https://imgur.com/t/{id}',
+    'https://i.imgur.com/{id}.jpg',
+]
+
+
+def legacy_classify(url):
+    """ The dispatch parse_id used before the router existed """
+    imgur_base_extensions = {
+        'album' : [r'(/a/)(\w+)'],
+        'gallery' : [r'(/g/)(\w+)', r'(/gallery/)(\w+)'],
+        'subreddit' : [r'(/r/)(\w+)\/(\w+)', r'(/r/)(\w+)$'],
+        'tag' : [r'(/t/)(\w+)']
+    }
+    for kind in ('album', 'gallery', 'subreddit', 'tag'):
+        if any(re.search(item, url) for item in imgur_base_extensions[kind]):
+            for item in imgur_base_extensions[kind]:
+                result = re.search(item, url).group(2) if re.search(item, url) else None
+                if result:
+                    return kind, result
+    return 'image', url[url.rfind('/') + 1:]
+
+
+def make_urls(count):
+    random.seed(0)
+    return [random.choice(URL_TEMPLATES).format(id='%07x' % random.getrandbits(28))
+            for _ in range(count)]
+
+
+def measure(name, function, urls):
+    start = perf_counter()
+    function(urls)
+    elapsed = perf_counter() - start
+    print('%-16s %9.0f urls/sec  (%.3f s)' % (name, len(urls) / elapsed, elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    urls = make_urls(count)
+    print('Classifying %d urls' % count)
+    measure('legacy', lambda urls: [legacy_classify(url) for url in urls], urls)
+    measure('classify', lambda urls: [router.classify(url) for url in urls], urls)
+    measure('classify_many', lambda urls: list(router.classify_many(urls)), urls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# Derek Santos
+""" Local stand-in for api.imgur.com and i.imgur.com used by the benchmarks.
+
+The same server answers API calls under /3/ and serves files under /i/.
+Latency, bandwidth, pagination depth, file sizes and 429 injection are
+configurable, and every request is counted.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+import json
+import random
+import re
+import threading
+
+CHUNK_SIZE = 1 << 16
+
+
+class Mock_Settings:
+    def __init__(self, latency=0.0, bandwidth=0, pages=5, page_size=50,
+                 album_size=10, file_size=256 * 1024, error_rate=0.0):
+        self.latency    = latency      # seconds before every response
+        self.bandwidth  = bandwidth    # bytes/sec per file transfer, 0 is unlimited
+        self.pages      = pages        # non-empty pages in every listing
+        self.page_size  = page_size    # items per listing page
+        self.album_size = album_size   # images per album
+        self.file_size  = file_size    # bytes per file
+        self.error_rate = error_rate   # chance of answering 429
+
+
+class Mock_Imgur:
+    def __init__(self, settings):
+        self.settings = settings
+        self.api_calls = 0
+        self.file_requests = 0
+        self.bytes_sent = 0
+        self.errors_sent = 0
+        self._lock = threading.Lock()
+        self._payload = bytes(random.Random(0).getrandbits(8) for _ in range(min(settings.file_size, CHUNK_SIZE)))
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def get_base_url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def get_api_url(self):
+        return self.get_base_url() + '/3'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def image(self, image_id):
+        return {'id': image_id,
+                'title': None,
+                'type': 'image/jpeg',
+                'animated': False,
+                'width': 1920,
+                'height': 1080,
+                'size': self.settings.file_size,
+                'datetime': int(time()),
+                'link': '%s/i/%s.jpg' % (self.get_base_url(), image_id)}
+
+    def album(self, album_id):
+        return {'id': album_id,
+                'title': None,
+                'images': [self.image('%s%d' % (album_id, position))
+                           for position in range(self.settings.album_size)]}
+
+    def listing(self, page, make_item):
+        if page >= self.settings.pages:
+            return []
+        first = page * self.settings.page_size
+        return [make_item('p%di%d' % (page, position))
+                for position in range(first, first + self.settings.page_size)]
+
+    def api_response(self, path):
+        base = self.get_base_url()
+
+        match = re.match(r'/3/account/\w+/favorites/(\d+)/\w+$', path)
+        if match:
+            return self.listing(int(match.group(1)),
+                                lambda item_id: {'id': item_id, 'link': '%s/a/%s' % (base, item_id)})
+
+        match = re.match(r'/3/account/\w+/images/(\d+)$', path)
+        if match:
+            return self.listing(int(match.group(1)), self.image)
+
+        match = re.match(r'/3/gallery/t/\w+/\w+/\w+/(\d+)$', path)
+        if match:
+            return {'items': self.listing(int(match.group(1)), self.album)}
+
+        match = re.match(r'/3/gallery/r/\w+/\w+/\w+/(\d+)$', path)
+        if match:
+            return self.listing(int(match.group(1)), self.image)
+
+        match = re.match(r'/3/(?:album|gallery)/(\w+)$', path)
+        if match:
+            return self.album(match.group(1))
+
+        return None
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, data, headers={}):
+                body = json.dumps({'data': data, 'status': status}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if mock.settings.latency:
+                    sleep(mock.settings.latency)
+
+                if random.random() < mock.settings.error_rate:
+                    mock.count(errors_sent=1)
+                    return self.send_json(429, {'error': 'Too Many Requests'}, {'Retry-After': '0.05'})
+
+                if self.path.startswith('/3/'):
+                    mock.count(api_calls=1)
+                    data = mock.api_response(self.path)
+                    if data is None:
+                        return self.send_json(404, {'error': 'Not found'})
+                    return self.send_json(200, data, {'X-RateLimit-UserRemaining': '100000',
+                                                      'X-RateLimit-UserReset': str(int(time()) + 3600)})
+
+                if self.path.startswith('/i/'):
+                    mock.count(file_requests=1)
+                    return self.send_file()
+
+                self.send_json(404, {'error': 'Not found'})
+
+            def send_file(self):
+                size = mock.settings.file_size
+                start = 0
+                match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if match and int(match.group(1)) < size:
+                    start = int(match.group(1))
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(size - start))
+                self.end_headers()
+
+                remaining = size - start
+                while remaining > 0:
+                    chunk = mock._payload[:min(remaining, len(mock._payload))]
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    mock.count(bytes_sent=len(chunk))
+                    if mock.settings.bandwidth:
+                        sleep(len(chunk) / float(mock.settings.bandwidth))
+
+        return Handler
@@ -0,0 +1,126 @@
+# Derek Santos
+""" End to end throughput benchmarks against a local mock Imgur.
+
+    python benchmarks/run_benchmarks.py [--scenario NAME] [--latency 0.05] ...
+
+Every scenario runs in its own process so peak RSS is per scenario.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'imgurtofolder'))
+
+from mock_imgur import Mock_Imgur, Mock_Settings
+
+SCENARIOS = ['big_album', 'deep_favorites', 'tag_pages', 'subreddit_listing']
+
+QUIET_LOGS = ['downloader', 'imgur', 'engine', 'paginator', 'manifest', 'store',
+              'pipeline', 'rate_limiter', 'metadata_cache', 'configuration', 'instrumentation']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark Imgur_Downloader against a mock Imgur.')
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append',
+                        help='Scenario to run. Can be repeated. Default: all')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every response')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Bytes/sec per transfer. 0 is unlimited')
+    parser.add_argument('--pages', type=int, default=5, help='Non-empty pages per listing')
+    parser.add_argument('--page-size', type=int, default=50, help='Items per listing page')
+    parser.add_argument('--album-size', type=int, default=10, help='Images per album')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Bytes per file')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Chance of a 429 per request')
+    parser.add_argument('--workers', type=int, default=4, help='Downloader --workers')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--report-dir', help='Write each scenario\'s run report (json) into this folder')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_scenario(name, args):
+    import configuration
+    import imgur_downloader
+    import logging
+
+    for log_name in QUIET_LOGS:
+        logging.getLogger(log_name).setLevel(logging.WARNING)
+
+    settings = Mock_Settings(latency=args.latency, bandwidth=args.bandwidth, pages=args.pages,
+                             page_size=args.page_size, album_size=args.album_size,
+                             file_size=args.file_size, error_rate=args.error_rate)
+    if name == 'big_album':
+        settings.album_size = args.album_size * args.page_size
+    if name == 'deep_favorites':
+        settings.album_size = 1
+    mock = Mock_Imgur(settings).start()
+    items = settings.pages * settings.page_size
+
+    with tempfile.TemporaryDirectory() as download_path:
+        config = configuration.Configuration(config_path=os.path.join(download_path, 'config.json'),
+                                             access_token='benchmark', client_id='benchmark',
+                                             download_path=download_path, workers=args.workers,
+                                             cache=False, report=bool(args.report_dir))
+        downloader = imgur_downloader.Imgur_Downloader(config, items)
+        downloader.set_api_url(mock.get_api_url())
+
+        start = perf_counter()
+        if name == 'big_album':
+            downloader.parse_id(mock.get_base_url() + '/a/big')
+        elif name == 'deep_favorites':
+            downloader.download_favorites('benchmark', max_items=items)
+        elif name == 'tag_pages':
+            downloader.parse_id(mock.get_base_url() + '/t/benchmark', max_items=items)
+        elif name == 'subreddit_listing':
+            downloader.parse_id(mock.get_base_url() + '/r/benchmark', max_items=items)
+        downloader.wait()
+        elapsed = perf_counter() - start
+
+        if args.report_dir:
+            downloader.write_report(os.path.join(args.report_dir, '%s.json' % name))
+
+    mock.stop()
+    files = mock.file_requests
+    return {'scenario': name,
+            'seconds': round(elapsed, 3),
+            'files': files,
+            'files_per_sec': round(files / elapsed, 1),
+            'mb_per_sec': round(mock.bytes_sent / float(1 << 20) / elapsed, 2),
+            'api_calls': mock.api_calls,
+            'api_calls_per_file': round(mock.api_calls / float(files), 3) if files else None,
+            'injected_429': mock.errors_sent,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)}
+
+
+def main():
+    args = parse_arguments()
+
+    if args.run_one:
+        print(json.dumps(run_scenario(args.run_one, args)))
+        return
+
+    passthrough = [argument for argument in sys.argv[1:] if argument != '--json']
+    results = []
+    for name in args.scenario or SCENARIOS:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-one', name] + passthrough,
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    columns = ['scenario', 'seconds', 'files', 'files_per_sec', 'mb_per_sec',
+               'api_calls_per_file', 'injected_429', 'peak_rss_mb']
+    print('  '.join('%18s' % column for column in columns))
+    for result in results:
+        print('  '.join('%18s' % result[column] for column in columns))
+
+
+if __name__ == '__main__':
+    main()
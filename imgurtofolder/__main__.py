@@ -1,15 +1,34 @@
 # Derek Santos
 import argparse
+import bandwidth
 import configuration
+import credentials
+import dircache
+import download_engine
+import filters
 import imgur
 import imgur_downloader
+import instrumentation
+import job
 import json
 import logs
+import manifest
+import metadata_cache
+import paginator
+import pipeline
+import planner
+import postprocess
+import progress
+import rate_limiter
+import store
+import watcher
+import work_queue
 from os.path import expanduser, exists, join
-from sys import platform
+from sys import platform, stdin
 from traceback import print_exc
 
 CONFIG_PATH = join( expanduser('~'), ".config", "imgurToFolder", 'config.json')
+CACHE_PATH = join( expanduser('~'), ".cache", "imgurToFolder", 'metadata.sqlite3')
 
 log = logs.Log('main')
 
@@ -17,7 +36,10 @@ def parse_arguments():
     """ Parse command line arguments """
     parser = argparse.ArgumentParser(description='Download images off Imgur to a folder of your choice!')
     parser.add_argument('urls', metavar='URLS', type=str,
-                        nargs='*', help='Automatically detect urls')
+                        nargs='*', help='Automatically detect urls. Use - to read urls from stdin')
+
+    parser.add_argument('--input-file', '-i', metavar='PATH',
+                        type=str, help='Read urls from a file, one per line. Use - for stdin')
 
     parser.add_argument('--folder', '-f', metavar='PATH',
                         type=str, help='Change desired folder path')
@@ -55,10 +77,196 @@ def parse_arguments():
     parser.add_argument('--window', choices=['day', 'week', 'month', 'year', 'all'], default='day',
                         help='Window of time for the sort method when using subreddit links. (Append "--sort top")')
 
+    parser.add_argument('--workers', metavar='N', type=int, default=4,
+                        help='Number of files to download at the same time. Default: 4')
+
+    parser.add_argument('--max-per-host', metavar='N', type=int,
+                        help='Maximum simultaneous downloads from a single host. Default: --workers')
+
+    parser.add_argument('--pool-size', metavar='N', type=int,
+                        help='Number of kept-alive connections per host. Default: max(10, --workers)')
+
+    parser.add_argument('--prefetch-pages', metavar='N', type=int, default=4,
+                        help='Pages of favorites, account images, tags and subreddits to request ahead. Default: 4')
+
+    parser.add_argument('--no-manifest', action='store_true',
+                        help='Do not record downloads in the manifest of the download path. (Skips by file name only.)')
+
+    parser.add_argument('--dedup', action='store_true',
+                        help='Store each image once and hardlink it into every folder that contains it.')
+
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always ask Imgur for album, gallery, tag and subreddit details.')
+
+    parser.add_argument('--verify', action='store_true',
+                        help='Check that every downloaded file decodes. Broken files are downloaded again on the next run.')
+
+    parser.add_argument('--thumbnails', metavar='SIZE', type=int, nargs='?', const=postprocess.THUMBNAIL_SIZE,
+                        help='Write a thumbnail of every downloaded image into .itf_thumbnails. Default size: 256. (Requires Pillow)')
+
+    parser.add_argument('--chunk-size', metavar='BYTES', type=int, default=1 << 20,
+                        help='Bytes read from the network and written to disk at a time. Default: 1048576')
+
+    parser.add_argument('--fsync-every', metavar='N', type=int, default=0,
+                        help='Flush downloads to disk after every N files. Default: 0 (left to the OS)')
+
+    parser.add_argument('--max-bandwidth', metavar='RATE', type=bandwidth.parse_rate,
+                        help='Cap downloads at RATE bytes per second, e.g. 500K or 2M. Shared evenly between urls, favorites and account images.')
+
+    parser.add_argument('--bandwidth-schedule', metavar='WINDOWS', type=bandwidth.parse_schedule,
+                        help='Different caps by time of day, e.g. "08:00-18:00=1M,18:00-23:00=5M". 0 is unlimited. Outside the windows --max-bandwidth applies.')
+
+    parser.add_argument('--resolve-workers', metavar='N', type=int, default=4,
+                        help='Number of urls to resolve at the same time. Default: 4')
+
+    parser.add_argument('--report', metavar='PATH', type=str,
+                        help='Write per-endpoint latency and throughput to a .json or .csv file at the end of the run')
+
+    parser.add_argument('--progress', action='store_true',
+                        help='Show a live progress line with throughput and ETA.')
+
+    parser.add_argument('--status-file', metavar='PATH', type=str,
+                        help='Rewrite a JSON status file with progress counters every few seconds')
+
+    parser.add_argument('--status-interval', metavar='SECONDS', type=float, default=1.0,
+                        help='How often the progress line and status file are refreshed. Default: 1')
+
+    parser.add_argument('--job', metavar='PATH', type=str,
+                        help='Download the sources of a JSON job file, spreading API calls over its credentials')
+
+    parser.add_argument('--coordinator', metavar='QUEUE_PATH', type=str,
+                        help='Resolve urls into a shared work queue instead of downloading them')
+
+    parser.add_argument('--worker', metavar='QUEUE_PATH', type=str,
+                        help='Download tasks from a shared work queue until it is drained')
+
+    parser.add_argument('--min-size', metavar='SIZE', type=filters.parse_size,
+                        help='Skip files smaller than SIZE, e.g. 100K')
+
+    parser.add_argument('--max-size', metavar='SIZE', type=filters.parse_size,
+                        help='Skip files larger than SIZE, e.g. 20M')
+
+    parser.add_argument('--min-width', metavar='PIXELS', type=int, help='Skip images narrower than PIXELS')
+
+    parser.add_argument('--max-width', metavar='PIXELS', type=int, help='Skip images wider than PIXELS')
+
+    parser.add_argument('--min-height', metavar='PIXELS', type=int, help='Skip images shorter than PIXELS')
+
+    parser.add_argument('--max-height', metavar='PIXELS', type=int, help='Skip images taller than PIXELS')
+
+    parser.add_argument('--type', metavar='TYPE', type=filters.parse_type, action='append', dest='types',
+                        help='Only download this type (jpg, png, gif, mp4... or a mime type). Can be repeated.')
+
+    animation = parser.add_mutually_exclusive_group()
+    animation.add_argument('--animated', action='store_const', const=True, dest='animated',
+                           help='Only download animated images and videos')
+    animation.add_argument('--static', action='store_const', const=False, dest='animated',
+                           help='Only download still images')
+
+    parser.add_argument('--after', metavar='YYYY-MM-DD', type=filters.parse_date,
+                        help='Skip images uploaded before this date')
+
+    parser.add_argument('--before', metavar='YYYY-MM-DD', type=filters.parse_date,
+                        help='Skip images uploaded on or after this date')
+
+    parser.add_argument('--variant', choices=imgur_downloader.VARIANTS, default=imgur_downloader.ORIGINAL,
+                        help='original: the uploaded file (mp4 for animations). smallest: the smaller of mp4 and gif for animations. '
+                             'capped: like smallest, and Imgur\'s resized copy of images larger than --max-resolution. Default: original')
+
+    parser.add_argument('--max-resolution', metavar='PIXELS', type=int,
+                        help='Longest side allowed with --variant capped (which it implies). Imgur has copies at 1024, 640, 320 and 160')
+
+    parser.add_argument('--plan', metavar='PATH', type=str,
+                        help='Resolve everything and write what would be downloaded to PATH, with totals and an estimated duration. Nothing is downloaded.')
+
+    parser.add_argument('--execute-plan', metavar='PATH', type=str,
+                        help='Download the files of a plan written by --plan without asking Imgur again')
+
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and download only new favorites, account images, tags and subreddits.')
+
+    parser.add_argument('--watch-interval', metavar='SECONDS', type=int, default=900,
+                        help='Seconds between two polls in --watch mode. Default: 900')
+
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Enables debugging output.')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.thumbnails and postprocess.Image is None:
+        parser.error('--thumbnails requires Pillow, install it with: pip install Pillow')
+    return args
+
+
+def runtime_options(args):
+    """ Options that only live for this run and are never saved """
+    return {'overwrite'    : args.overwrite,
+            'workers'      : args.workers,
+            'max_per_host' : args.max_per_host,
+            'pool_size'    : args.pool_size,
+            'prefetch_pages' : args.prefetch_pages,
+            'manifest'     : not args.no_manifest,
+            'dedup'        : args.dedup,
+            'cache'        : not args.no_cache,
+            'cache_path'   : CACHE_PATH,
+            'resolve_workers' : args.resolve_workers,
+            'verify'       : args.verify,
+            'thumbnail_size' : args.thumbnails,
+            'chunk_size'   : args.chunk_size,
+            'fsync_every'  : args.fsync_every,
+            'max_bandwidth' : args.max_bandwidth,
+            'bandwidth_schedule' : args.bandwidth_schedule,
+            'task_filter'  : task_filter(args),
+            'variant'      : imgur_downloader.CAPPED if args.max_resolution else args.variant,
+            'max_resolution' : args.max_resolution,
+            'report'       : bool(args.report)}
+
+
+def task_filter(args):
+    """ Metadata filter from the command line, None when no filter is given """
+    current_filter = filters.Task_Filter(min_size   = args.min_size,
+                                         max_size   = args.max_size,
+                                         min_width  = args.min_width,
+                                         max_width  = args.max_width,
+                                         min_height = args.min_height,
+                                         max_height = args.max_height,
+                                         types      = args.types,
+                                         animated   = args.animated,
+                                         after      = args.after,
+                                         before     = args.before)
+    return current_filter if current_filter.is_enabled() else None
+
+
+def iter_input_urls(args):
+    """ Urls from the command line, --input-file and stdin, read lazily """
+    for url in args.urls:
+        if url == '-':
+            yield from stdin
+        else:
+            yield url
+
+    if args.input_file == '-':
+        yield from stdin
+    elif args.input_file:
+        with open(args.input_file, 'r') as input_file:
+            yield from input_file
+
+
+def watch(downloader, args):
+    """ Poll the requested sources forever, downloading only what is new """
+    sync = watcher.Watcher(downloader, interval=args.watch_interval,
+                           max_items=args.max_downloads if args.max_downloads else -1)
+    for url in iter_input_urls(args):
+        if url.strip() and not sync.add_url(url):
+            log.info('Only tag and subreddit urls can be watched, ignoring: %s' % url.strip())
+    if args.download_favorites is not None:
+        sync.add_favorites(args.download_favorites)
+    if args.download_account_images is not None:
+        sync.add_account_images(args.download_account_images)
+
+    if not sync.get_sources():
+        log.info('Nothing to watch. Pass tag or subreddit urls, --download-favorites or --download-account-images')
+        return
+    sync.run()
 
 
 def create_config():
@@ -108,7 +316,7 @@ def main():
                                              client_secret = data['client_secret'],
                                              download_path = data['download_path'],
                                              refresh_token = data['refresh_token'],
-                                             overwrite     = args.overwrite)
+                                             **runtime_options(args))
 
     else:
         log.debug('No configuation found!')
@@ -117,7 +325,7 @@ def main():
                                              client_id     = result_config['client_id'],
                                              client_secret = result_config['client_secret'],
                                              download_path = result_config['download_path'],
-                                             overwrite     = args.overwrite)
+                                             **runtime_options(args))
         config.save_configuration(True)
 
 
@@ -129,6 +337,24 @@ def main():
         imgur.log.set_debug()
         imgur_downloader.log.set_debug()
         configuration.log.set_debug()
+        download_engine.log.set_debug()
+        watcher.log.set_debug()
+        job.log.set_debug()
+        work_queue.log.set_debug()
+        postprocess.log.set_debug()
+        bandwidth.log.set_debug()
+        filters.log.set_debug()
+        planner.log.set_debug()
+        dircache.log.set_debug()
+        paginator.log.set_debug()
+        manifest.log.set_debug()
+        store.log.set_debug()
+        metadata_cache.log.set_debug()
+        pipeline.log.set_debug()
+        instrumentation.log.set_debug()
+        progress.log.set_debug()
+        credentials.log.set_debug()
+        rate_limiter.log.set_debug()
 
     if args.print_download_path:
         log.info('Default download path: ' + config.get_download_path())
@@ -141,6 +367,10 @@ def main():
     if args.change_default_folder:
         downloader.set_default_folder_path(args.change_default_folder)
 
+    downloader.start_progress(tty=args.progress,
+                              status_path=args.status_file,
+                              interval=args.status_interval)
+
     if args.list_all_favorites is not None:
         downloader.list_favorites(args.list_all_favorites,
                                   latest=True,
@@ -148,18 +378,47 @@ def main():
                                   max_items=args.max_downloads if args.max_downloads else -1)
 
 
-    log.debug('Parsing ids')
-    for item in args.urls:
-        try:
-            downloader.parse_id(item,
-                                page=args.start_page,
-                                max_items=args.max_downloads if args.max_downloads else 30,
-                                sort=args.sort,
-                                window=args.window)
-        except Exception as e:
-            message = 'Error with url {}. Error Message: \n\n'.format(item)
-            log.exception(message)
+    if args.job:
+        current_job = job.load_job(args.job)
+        current_job.apply(downloader)
+
+    if args.worker:
+        work_queue.Queue_Worker(downloader, work_queue.Work_Queue(args.worker)).run()
+        downloader.wait()
+        downloader.stop_progress()
+        if args.report:
+            downloader.write_report(args.report)
+        return
+
+    if args.coordinator:
+        shared_queue = work_queue.Work_Queue(args.coordinator)
+        shared_queue.set_open(True)
+        downloader.set_work_queue(shared_queue)
+
+    if args.plan:
+        current_plan = planner.Plan(downloader.get_download_path())
+        downloader.set_plan(current_plan)
+
+    if args.watch and not args.plan:
+        watch(downloader, args)
+        downloader.stop_progress()
+        return
 
+    if args.execute_plan:
+        downloader.queue_tasks(planner.load_plan(args.execute_plan, downloader.get_download_path()))
+
+    log.debug('Parsing ids')
+    downloader.download_urls(iter_input_urls(args),
+                             page=args.start_page,
+                             max_items=args.max_downloads if args.max_downloads else 30,
+                             sort=args.sort,
+                             window=args.window)
+
+    if args.job:
+        log.debug('Running job sources')
+        current_job.run(downloader,
+                        page=args.start_page,
+                        max_items=args.max_downloads if args.max_downloads else 30)
 
     if args.download_favorites is not None:
         log.debug('Downloading favorites by {}'.format("Oldest" if args.oldest else "Latest"))
@@ -176,6 +435,25 @@ def main():
                                            page=args.start_page,
                                            max_items=args.max_downloads if args.max_downloads else 30)
 
+    log.debug('Waiting for queued downloads')
+    downloader.wait()
+    downloader.stop_progress()
+
+    if args.coordinator:
+        shared_queue.set_open(False)
+        log.info('Work queue: %(pending)d pending, %(done)d done, %(failed)d failed' % shared_queue.get_counts())
+
+    if args.report:
+        downloader.write_report(args.report)
+
+    if args.plan:
+        summary = downloader.plan_summary()
+        current_plan.log_summary(summary)
+        current_plan.save(args.plan, summary)
+
+    if config.get_task_filter() and config.get_task_filter().get_skipped():
+        log.info('Filtered out %d files (%.2f MB)' % (config.get_task_filter().get_skipped(),
+                                                      config.get_task_filter().get_skipped_bytes() / float(1 << 20)))
 
     log.info('Done.')
 
@@ -0,0 +1,119 @@
+# Derek Santos
+from datetime import datetime
+from rate_limiter import Token_Bucket
+from time import monotonic
+import logs
+import re
+import threading
+
+log = logs.Log('bandwidth')
+
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+# A source's bucket holds at most this many seconds of its share
+BURST_SECONDS = 0.25
+
+# Reads are cut to this size while a cap is set, so the socket is drained
+# (and the sender slowed down) in small, evenly paced steps
+CHUNK_SIZE = 1 << 16
+
+# Caps are looked up again at most this often, so a schedule window
+# starts within a few seconds of its time
+SCHEDULE_CHECK_SECONDS = 5
+
+
+def parse_rate(text):
+    """ '500K', '2M', '1.5G' bytes per second. 0 means unlimited. """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*$', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid bandwidth: %s' % text)
+    rate = float(match.group(1)) * UNITS[match.group(2).upper()]
+    return rate if rate > 0 else None
+
+
+def parse_schedule(text):
+    """ '08:00-18:00=1M,18:00-23:00=5M' into [(start, end, rate)] with
+    times as minutes after midnight. Windows may wrap past midnight. """
+    schedule = []
+    for window in filter(None, (part.strip() for part in text.split(','))):
+        match = re.match(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.+)$', window)
+        if match is None:
+            raise ValueError('Invalid bandwidth window: %s' % window)
+        start = int(match.group(1)) * 60 + int(match.group(2))
+        end   = int(match.group(3)) * 60 + int(match.group(4))
+        schedule.append((start, end, parse_rate(match.group(5))))
+    return schedule
+
+
+class Bandwidth_Limiter:
+    """ Caps download bytes per second and splits them evenly between sources.
+
+    Every source with a transfer running (a url, favorites, account
+    images...) gets an equal share of the cap, shared again by its own
+    transfers. The cap may change by time of day through `schedule`.
+    """
+
+    def __init__(self, rate=None, schedule=None):
+        self._rate      = rate
+        self._schedule  = schedule if schedule else []
+        self._current   = None
+        self._checked   = float('-inf')
+        self._sources   = {}
+        self._active    = {}
+        self._lock      = threading.Lock()
+
+    def get_rate(self, now=None):
+        """ Cap in bytes per second at `now`, None when unlimited """
+        now = now if now else datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self._schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return self._rate
+
+    def is_enabled(self):
+        return self._rate is not None or bool(self._schedule)
+
+    def _rebalance(self):
+        share = self._current / len(self._active) if self._current and self._active else None
+        for source in self._active:
+            self._sources[source].set_rate(share, capacity=max(1, share * BURST_SECONDS) if share else None)
+
+    def _check_schedule(self):
+        """ Returns True when the cap changed """
+        now = monotonic()
+        if now - self._checked < SCHEDULE_CHECK_SECONDS:
+            return False
+        self._checked = now
+        rate = self.get_rate()
+        if rate == self._current:
+            return False
+        log.info('Bandwidth cap: %s' % ('%.2f MB/s' % (rate / float(1 << 20)) if rate else 'unlimited'))
+        self._current = rate
+        return True
+
+    def start(self, source):
+        """ A transfer for `source` begins """
+        with self._lock:
+            if source not in self._sources:
+                self._sources[source] = Token_Bucket()
+            self._active[source] = self._active.get(source, 0) + 1
+            self._check_schedule()
+            self._rebalance()
+
+    def finish(self, source):
+        with self._lock:
+            self._active[source] -= 1
+            if not self._active[source]:
+                del self._active[source]
+                del self._sources[source]
+            self._rebalance()
+
+    def consume(self, source, size):
+        """ Wait until `source` may read `size` more bytes """
+        with self._lock:
+            if self._check_schedule():
+                self._rebalance()
+            bucket = self._sources[source]
+        bucket.acquire(size)
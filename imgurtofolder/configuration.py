@@ -8,7 +8,11 @@ log = logs.Log('configuration')
 class Configuration:
     def __init__(self, config_path, access_token='', client_id='',
             client_secret='', download_path='', refresh_token='',
-            overwrite=False):
+            overwrite=False, workers=4, max_per_host=None, pool_size=None,
+            prefetch_pages=4, manifest=True, dedup=False, cache=True,
+            cache_path=None, resolve_workers=4, verify=False, thumbnail_size=None,
+            chunk_size=1 << 20, fsync_every=0, max_bandwidth=None, bandwidth_schedule=None,
+            task_filter=None, variant='original', max_resolution=None, report=False):
         log.debug('Setting configuration')
         self._config_path   = config_path
         self._access_token  = access_token
@@ -17,6 +21,25 @@ class Configuration:
         self._download_path = os.path.realpath(os.path.expanduser(download_path))
         self._refresh_token = refresh_token
         self._overwrite     = overwrite
+        self._workers       = workers
+        self._max_per_host  = max_per_host
+        self._pool_size     = pool_size if pool_size else max(10, workers)
+        self._prefetch_pages = prefetch_pages
+        self._manifest      = manifest
+        self._dedup         = dedup
+        self._cache         = cache
+        self._cache_path    = cache_path
+        self._resolve_workers = resolve_workers
+        self._verify        = verify
+        self._thumbnail_size = thumbnail_size
+        self._chunk_size    = chunk_size
+        self._fsync_every   = fsync_every
+        self._max_bandwidth = max_bandwidth
+        self._bandwidth_schedule = bandwidth_schedule
+        self._task_filter   = task_filter
+        self._variant       = variant
+        self._max_resolution = max_resolution
+        self._report        = report
         log.debug('Configuration set')
 
     def set_access_token(self, token):
@@ -66,6 +89,63 @@ class Configuration:
     def get_overwrite(self):
         return self._overwrite
 
+    def get_workers(self):
+        return self._workers
+
+    def get_max_per_host(self):
+        return self._max_per_host
+
+    def get_pool_size(self):
+        return self._pool_size
+
+    def get_prefetch_pages(self):
+        return self._prefetch_pages
+
+    def get_manifest(self):
+        return self._manifest
+
+    def get_dedup(self):
+        return self._dedup
+
+    def get_cache(self):
+        return self._cache
+
+    def get_cache_path(self):
+        return self._cache_path
+
+    def get_resolve_workers(self):
+        return self._resolve_workers
+
+    def get_verify(self):
+        return self._verify
+
+    def get_thumbnail_size(self):
+        return self._thumbnail_size
+
+    def get_chunk_size(self):
+        return self._chunk_size
+
+    def get_fsync_every(self):
+        return self._fsync_every
+
+    def get_max_bandwidth(self):
+        return self._max_bandwidth
+
+    def get_bandwidth_schedule(self):
+        return self._bandwidth_schedule
+
+    def get_task_filter(self):
+        return self._task_filter
+
+    def get_variant(self):
+        return self._variant
+
+    def get_max_resolution(self):
+        return self._max_resolution
+
+    def get_report(self):
+        return self._report
+
     def convert_config_to_dict(self, overwrite_download_path=False):
         log.debug('Converting configuration to json')
         current_config = {}
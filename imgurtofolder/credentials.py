@@ -0,0 +1,75 @@
+# Derek Santos
+from collections import namedtuple
+import logs
+import threading
+
+log = logs.Log('credentials')
+
+# `account` is the Imgur username the access token belongs to, `budget` the
+# rate limit budget the credential's API calls are paced under
+Credential = namedtuple('Credential', ['name', 'client_id', 'access_token', 'account', 'budget'])
+
+DEFAULT = 'default'
+
+
+class Credential_Pool:
+    """ Spreads API calls over several Imgur clients.
+
+    Every call goes to the client with the most remaining quota. Clients that
+    are exhausted or backing off after a 429 are only used when all of them
+    are, so a retry fails over to the next client.
+    """
+
+    def __init__(self, scheduler):
+        self._scheduler   = scheduler
+        self._credentials = []
+        self._picks       = {}
+        self._lock        = threading.Lock()
+
+    def add(self, name, client_id, access_token='', account=None):
+        # The configured client keeps the plain 'api' budget
+        budget = 'api' if name == DEFAULT else 'api:%s' % name
+        credential = Credential(name, client_id, access_token, account, budget)
+        with self._lock:
+            self._credentials = [current for current in self._credentials if current.name != name]
+            self._credentials.append(credential)
+            self._picks.setdefault(name, 0)
+        log.debug('Added credential %s' % name)
+        return credential
+
+    def set_access_token(self, name, access_token):
+        with self._lock:
+            self._credentials = [current._replace(access_token=access_token) if current.name == name else current
+                                 for current in self._credentials]
+
+    def get_credentials(self):
+        with self._lock:
+            return list(self._credentials)
+
+    def has_access_token(self, account=None):
+        return any(credential.access_token and (account is None or credential.account in (None, account))
+                   for credential in self.get_credentials())
+
+    def get_quota(self, credential):
+        """ Sort key, higher is better. Unknown quota counts as full. """
+        bucket = self._scheduler.get_bucket(credential.budget)
+        remaining = self._scheduler.get_remaining(credential.budget)
+        return (bucket.get_pause() == 0 and remaining != 0,
+                float('inf') if remaining is None else remaining,
+                -self._picks[credential.name])
+
+    def choose(self, bearer=False, account=None):
+        """ Credential for the next call. Bearer calls for `account` use a
+        token of that account when there is one. """
+        credentials = [credential for credential in self.get_credentials() if credential.client_id]
+        if bearer:
+            credentials = [credential for credential in credentials if credential.access_token]
+            owned = [credential for credential in credentials if account and credential.account == account]
+            credentials = owned if owned else credentials
+        if not credentials:
+            raise Exception('No %s credential available' % ('access token' if bearer else 'client id'))
+
+        with self._lock:
+            credential = max(credentials, key=self.get_quota)
+            self._picks[credential.name] += 1
+        return credential
@@ -0,0 +1,91 @@
+# Derek Santos
+import logs
+import os
+import threading
+
+log = logs.Log('dircache')
+
+
+class Directory_Cache:
+    """ What the download folders contain, read once per folder.
+
+    The first question about a folder lists it with a single os.scandir;
+    every later existence check is answered from memory, and each folder is
+    created at most once. The downloader reports the files it writes,
+    renames and removes so the listings stay current. Changes made by other
+    programs while the run is going are not seen until clear().
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._folder_locks = {}
+        self._lock = threading.Lock()
+
+    def _folder_lock(self, folder):
+        with self._lock:
+            if folder not in self._folder_locks:
+                self._folder_locks[folder] = threading.Lock()
+            return self._folder_locks[folder]
+
+    def listing(self, folder):
+        """ Names in `folder`, None if it does not exist """
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if folder in self._listings:
+                return self._listings[folder]
+
+        # Held per folder so a listing never misses a file written meanwhile
+        with self._folder_lock(folder):
+            with self._lock:
+                if folder in self._listings:
+                    return self._listings[folder]
+            try:
+                log.debug('Listing folder: %s' % folder)
+                with os.scandir(folder) as entries:
+                    names = set(entry.name for entry in entries)
+            except (FileNotFoundError, NotADirectoryError):
+                names = None
+            with self._lock:
+                self._listings[folder] = names
+            return names
+
+    def exists(self, path):
+        names = self.listing(os.path.dirname(path))
+        return names is not None and os.path.basename(path) in names
+
+    def makedirs(self, folder):
+        if self.listing(folder) is not None:
+            return
+
+        folder = os.path.normpath(folder)
+        with self._folder_lock(folder):
+            with self._lock:
+                if self._listings.get(folder) is not None:
+                    return
+            log.debug('Creating folder: %s' % folder)
+            os.makedirs(folder, exist_ok=True)
+            with self._lock:
+                self._listings[folder] = set()
+                # Parents now hold a new folder, list them again when asked
+                child, parent = folder, os.path.dirname(folder)
+                while parent and parent != child:
+                    self._listings.pop(parent, None)
+                    child, parent = parent, os.path.dirname(parent)
+
+    def added(self, path):
+        """ `path` was written """
+        with self._lock:
+            names = self._listings.get(os.path.normpath(os.path.dirname(path)))
+            if names is not None:
+                names.add(os.path.basename(path))
+
+    def removed(self, path):
+        """ `path` was removed or renamed """
+        with self._lock:
+            names = self._listings.get(os.path.normpath(os.path.dirname(path)))
+            if names is not None:
+                names.discard(os.path.basename(path))
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
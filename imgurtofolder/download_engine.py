@@ -0,0 +1,78 @@
+# Derek Santos
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+import logs
+import threading
+
+log = logs.Log('engine')
+
+
+class Download_Engine:
+    """ Worker pool that runs downloads concurrently.
+
+    Submitting blocks once `max_in_flight` tasks are queued or running, so
+    producers never race ahead of the network. Each host additionally gets
+    its own cap of `max_per_host` simultaneous requests.
+    """
+
+    def __init__(self, workers=4, max_in_flight=None, max_per_host=None):
+        self._workers       = max(1, workers)
+        self._max_in_flight = max_in_flight if max_in_flight else self._workers * 2
+        self._max_per_host  = max_per_host if max_per_host else self._workers
+        self._executor      = ThreadPoolExecutor(max_workers=self._workers,
+                                                 thread_name_prefix='itf-download')
+        self._in_flight     = threading.BoundedSemaphore(self._max_in_flight)
+        self._hosts         = {}
+        self._hosts_lock    = threading.Lock()
+        self._futures       = set()
+        self._futures_lock  = threading.Lock()
+        log.debug('Engine started with %d workers' % self._workers)
+
+    def get_workers(self):
+        return self._workers
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self._max_per_host)
+            return self._hosts[host]
+
+    def _run(self, function, url, args, kwargs):
+        try:
+            with self._host_slot(url):
+                return function(*args, **kwargs)
+        except Exception:
+            log.exception('Error while downloading %s' % url)
+        finally:
+            self._in_flight.release()
+
+    def _forget(self, future):
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def submit(self, function, url, *args, **kwargs):
+        self._in_flight.acquire()
+        try:
+            future = self._executor.submit(self._run, function, url, args, kwargs)
+        except Exception:
+            self._in_flight.release()
+            raise
+
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def wait(self):
+        while True:
+            with self._futures_lock:
+                pending = set(self._futures)
+            if not pending:
+                return
+            wait(pending)
+
+    def shutdown(self, cancel=False):
+        if not cancel:
+            self.wait()
+        self._executor.shutdown(wait=not cancel, cancel_futures=cancel)
@@ -0,0 +1,143 @@
+# Derek Santos
+from datetime import datetime
+import logs
+import os
+import re
+import threading
+
+log = logs.Log('filters')
+
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+# Short names accepted by --type
+TYPES = {'jpg'  : 'image/jpeg',
+         'jpeg' : 'image/jpeg',
+         'png'  : 'image/png',
+         'gif'  : 'image/gif',
+         'webp' : 'image/webp',
+         'mp4'  : 'video/mp4',
+         'webm' : 'video/webm'}
+
+
+def parse_size(text):
+    """ '500K', '20M', '1.5G' or a plain number of bytes """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?\s*$', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid size: %s' % text)
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def parse_date(text):
+    """ YYYY-MM-DD (local time) into a unix timestamp """
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+def task_size(task):
+    """ Bytes `task` will download according to its metadata, None if unknown.
+    For gifs that are downloaded as mp4 the size of the mp4 is used. """
+    metadata = task.metadata
+    if not metadata:
+        return None
+    # Imgur only reports the size of the original, not of its resized copies
+    link_id = os.path.splitext(task.url[task.url.rfind('/') + 1:])[0]
+    if metadata.get('id') and link_id != metadata['id']:
+        return None
+    if task.filename.endswith('.mp4') and metadata.get('mp4_size'):
+        return metadata['mp4_size']
+    return metadata.get('size')
+
+
+def parse_type(text):
+    text = text.strip().lower()
+    return TYPES.get(text.lstrip('.'), text)
+
+
+class Task_Filter:
+    """ Drops File_Tasks whose Imgur metadata does not match, before any
+    request is made for the file itself.
+
+    Tasks without metadata (plain image links) always pass. For gifs that
+    are downloaded as mp4 the size and type of the mp4 are used.
+    """
+
+    def __init__(self, min_size=None, max_size=None, min_width=None, max_width=None,
+                 min_height=None, max_height=None, types=None, animated=None,
+                 after=None, before=None):
+        self._min_size   = min_size
+        self._max_size   = max_size
+        self._min_width  = min_width
+        self._max_width  = max_width
+        self._min_height = min_height
+        self._max_height = max_height
+        self._types      = set(types) if types else None
+        self._animated   = animated
+        self._after      = after
+        self._before     = before
+        self._lock       = threading.Lock()
+        self._skipped    = 0
+        self._skipped_bytes = 0
+
+    def is_enabled(self):
+        return any(value is not None for value in (self._min_size, self._max_size, self._min_width,
+                                                   self._max_width, self._min_height, self._max_height,
+                                                   self._types, self._animated, self._after, self._before))
+
+    def get_skipped(self):
+        return self._skipped
+
+    def get_skipped_bytes(self):
+        return self._skipped_bytes
+
+    def get_type(self, task):
+        filetype = TYPES.get(os.path.splitext(task.filename)[1].lstrip('.').lower())
+        return filetype if filetype else task.metadata.get('type')
+
+    def reason(self, task):
+        """ Why `task` is filtered out, None if it is kept """
+        metadata = task.metadata
+        if not metadata:
+            return None
+
+        size = task_size(task)
+        if size is not None:
+            if self._min_size is not None and size < self._min_size:
+                return 'smaller than %d bytes' % self._min_size
+            if self._max_size is not None and size > self._max_size:
+                return 'larger than %d bytes' % self._max_size
+
+        width, height = metadata.get('width'), metadata.get('height')
+        if width is not None:
+            if self._min_width is not None and width < self._min_width:
+                return 'narrower than %d' % self._min_width
+            if self._max_width is not None and width > self._max_width:
+                return 'wider than %d' % self._max_width
+        if height is not None:
+            if self._min_height is not None and height < self._min_height:
+                return 'shorter than %d' % self._min_height
+            if self._max_height is not None and height > self._max_height:
+                return 'taller than %d' % self._max_height
+
+        if self._types is not None and self.get_type(task) not in self._types:
+            return 'type %s' % self.get_type(task)
+
+        if self._animated is not None and 'animated' in metadata and metadata['animated'] != self._animated:
+            return 'animated' if metadata['animated'] else 'static'
+
+        uploaded = metadata.get('datetime')
+        if uploaded is not None:
+            if self._after is not None and uploaded < self._after:
+                return 'uploaded before the date range'
+            if self._before is not None and uploaded >= self._before:
+                return 'uploaded after the date range'
+        return None
+
+    def accept(self, task):
+        reason = self.reason(task)
+        if reason is None:
+            return True
+
+        log.debug('Filtered out %s: %s' % (task.filename, reason))
+        with self._lock:
+            self._skipped += 1
+            self._skipped_bytes += task_size(task) or 0
+        return False
@@ -1,18 +1,117 @@
 import logs
+from credentials import DEFAULT, Credential_Pool
+from instrumentation import Recorder
+from metadata_cache import FOREVER, LISTING_TTL, Metadata_Cache
+from paginator import Paginator
+from rate_limiter import Rate_Limit_Scheduler
 from pprint import pformat
 import re
 import requests
+from requests.adapters import HTTPAdapter
 import webbrowser
-from time import sleep
+from time import perf_counter, sleep
 import os
+import threading
 
 log = logs.Log('imgur')
 
+API_URL = 'https://api.imgur.com/3'
+
 
 class Imgur:
     def __init__(self, configuration):
         log.debug('Configuration set')
         self._configuration = configuration
+        self._api_url = API_URL
+        self._session = self.create_session(configuration.get_pool_size())
+        self._scheduler = Rate_Limit_Scheduler()
+        self._credentials = Credential_Pool(self._scheduler)
+        self._credentials.add(DEFAULT, configuration.get_client_id(), configuration.get_access_token())
+        self._metadata_cache = Metadata_Cache(configuration.get_cache_path()) if configuration.get_cache() else None
+        # Only kept when a run report was asked for
+        self._recorder = Recorder() if configuration.get_report() else None
+        self._api_calls = 0
+        self._api_calls_lock = threading.Lock()
+
+    def create_session(self, pool_size):
+        # One keep-alive session for the whole run so api.imgur.com and
+        # i.imgur.com connections are reused instead of re-handshaking
+        log.debug('Creating session with pool size %d' % pool_size)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def set_api_url(self, url):
+        log.debug('Changed api url to %s' % url)
+        self._api_url = url.rstrip('/')
+
+    def get_scheduler(self):
+        return self._scheduler
+
+    def get_credentials(self):
+        return self._credentials
+
+    def add_credential(self, name, client_id, access_token='', account=None):
+        return self._credentials.add(name, client_id, access_token, account)
+
+    def auth_headers(self, credential, bearer=False):
+        if bearer:
+            return {'Authorization': 'Bearer %s' % credential.access_token}
+        return {'Authorization': 'Client-ID %s' % credential.client_id}
+
+    def require_access_token(self, account=None):
+        if not self._credentials.has_access_token(account):
+            self.authorize()
+
+    def get_recorder(self):
+        return self._recorder
+
+    def get_api_calls(self):
+        return self._api_calls
+
+    def write_report(self, path):
+        if self._recorder is None:
+            log.info('No run report was recorded')
+            return
+        self._recorder.write_report(path)
+
+    def request(self, method, url, budget='api', retries=5, endpoint=None, auth=None, account=None, **kwargs):
+        # Paced by the rate limit headers of earlier responses.
+        # 429 and 5xx responses are retried with a jittered backoff.
+        # Streamed responses are recorded by whoever reads the body.
+        # auth is 'client' or 'bearer'. The credential, and with it the
+        # budget, is picked again for every attempt so retries fail over.
+        headers = kwargs.pop('headers', None) or {}
+        for attempt in range(retries + 1):
+            if auth:
+                credential = self._credentials.choose(bearer=auth == 'bearer', account=account)
+                budget = credential.budget
+                kwargs['headers'] = dict(headers, **self.auth_headers(credential, auth == 'bearer'))
+            else:
+                kwargs['headers'] = headers
+            self._scheduler.acquire(budget)
+            started = perf_counter()
+            response = self._session.request(method, url, **kwargs)
+            self._scheduler.update(budget, response.headers)
+            response.retries = attempt
+            if auth:
+                with self._api_calls_lock:
+                    self._api_calls += 1
+
+            if attempt == retries or not (response.status_code == 429 or response.status_code >= 500):
+                if not kwargs.get('stream') and self._recorder is not None:
+                    ttfb = response.elapsed.total_seconds()
+                    self._recorder.record(endpoint if endpoint else budget, response.status_code,
+                                          ttfb=ttfb, transfer=max(0, perf_counter() - started - ttfb),
+                                          size=len(response.content), retries=attempt,
+                                          remaining=self._scheduler.get_remaining(budget))
+                return response
+
+            log.debug('Status %d for %s, retrying' % (response.status_code, url))
+            self._scheduler.backoff(budget, attempt, response.headers.get('Retry-After'))
+            response.close()
 
     def set_configuration(self, configuration):
         log.debug('Changed configuration')
@@ -36,6 +135,12 @@ class Imgur:
     def get_overwrite(self):
         return self._configuration.get_overwrite()
 
+    def get_workers(self):
+        return self._configuration.get_workers()
+
+    def get_resolve_workers(self):
+        return self._configuration.get_resolve_workers()
+
     def authorize(self):
         url  = 'https://api.imgur.com/oauth2/authorize?'
         url += 'response_type=token'
@@ -57,6 +162,7 @@ class Imgur:
         refresh_token = re.search('refresh_token=(\w+)', user_input).group(1)
         self._configuration.set_access_token(access_token)
         self._configuration.set_refresh_token(refresh_token)
+        self._credentials.set_access_token(DEFAULT, access_token)
         self._configuration.save_configuration()
         log.debug('Configuration saved')
         log.info('The application is now authorized')
@@ -67,134 +173,133 @@ class Imgur:
                     'client_id': self._configuration.get_client_id(),
                     'client_secret': self._configuration.get_client_secret(),
                     'grant_type': 'refresh_token'}
-        response = requests.request('POST',
-                                    url,
-                                    headers = headers,
-                                    data = data,
-                                    allow_redirects=False)
+        response = self.request('POST',
+                                url,
+                                headers = headers,
+                                data = data,
+                                allow_redirects=False)
         response_json = response.json()
 
         # TODO: Make sure this works
         self._configuration.set_access_token(response_json['access_token'])
+        self._credentials.set_access_token(DEFAULT, response_json['access_token'])
+
+    def get_json(self, url, ttl=0, endpoint=None, auth='client', account=None):
+        # ttl=0 bypasses the cache, FOREVER never expires
+        cache = self._metadata_cache if ttl != 0 else None
+        entry = cache.lookup(url) if cache else None
+        if entry and cache.is_fresh(entry, ttl):
+            log.debug('Cache hit: %s' % url)
+            return 200, entry['data']
+
+        request_headers = {}
+        if entry and entry['etag']:
+            request_headers['If-None-Match'] = entry['etag']
+
+        response = self.request('GET', url, headers=request_headers, endpoint=endpoint,
+                                auth=auth, account=account)
+        if response.status_code == 304 and entry:
+            log.debug('Not modified: %s' % url)
+            cache.touch(url)
+            return 200, entry['data']
 
-    def get_url_data(self, url, headers, data):
-            response = requests.request('GET', url,  headers=headers, data=data)
-            if response.status_code == 200 and not 'error' in response.json()['data']:
-                return response.json()['data']
+        response_json = response.json()
+        if cache and response.status_code == 200:
+            cache.store(url, response_json, response.headers.get('ETag'))
+        return response.status_code, response_json
+
+    def get_url_data(self, url, data=None, ttl=0, endpoint=None, auth='client', account=None):
+            if data is None:
+                status_code, response_json = self.get_json(url, ttl=ttl, endpoint=endpoint,
+                                                           auth=auth, account=account)
             else:
-                message = (response.status_code, pformat(response.json()['data']))
+                response = self.request('GET', url, data=data, endpoint=endpoint,
+                                        auth=auth, account=account)
+                status_code, response_json = response.status_code, response.json()
+
+            if status_code == 200 and not 'error' in response_json['data']:
+                return response_json['data']
+            else:
+                message = (str(status_code), pformat(response_json['data']))
                 log.error(' '.join(message))
                 raise Exception(message)
 
-    def get_account_images(self, username, page=0):
+    def iter_account_images(self, username, page=0, max_items=-1, prefetch=None):
 
-        if not self._configuration.get_access_token():
-            self.authorize()
+        self.require_access_token(username)
 
-        url = f'https://api.imgur.com/3/account/{username}/images/{page}'
-        headers = {
-            'Authorization': 'Bearer %s' % self._configuration.get_access_token()
-        }
-        account_images = []
-        response = self.get_url_data(url, headers, None)
+        def fetch_page(page):
+            url = f'{self._api_url}/account/{username}/images/{page}'
+            return self.get_url_data(url, endpoint='account_images', auth='bearer', account=username)
 
-        while len(response) != 0:
-            log.info('Getting page %d of account images' % page)
-            for item in response:
-                account_images.append(item)
-            url = f'https://api.imgur.com/3/account/{username}/images/{page}'
-            response = self.get_url_data(url, headers, None)
-            page += 1
+        return Paginator(fetch_page, page=page, max_items=max_items,
+                         prefetch=prefetch if prefetch is not None else self._configuration.get_prefetch_pages(),
+                         name='account images')
 
-        return account_images
+    def get_account_images(self, username, page=0):
+        return list(self.iter_account_images(username, page=page))
 
     def get_gallery_favorites(self, username, sort='newest'):
-        url = f'https://api.imgur.com/3/account/{username}/gallery_favorites/{sort}'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
+        url = f'{self._api_url}/account/{username}/gallery_favorites/{sort}'
+        response = self.request('GET', url, endpoint='gallery_favorites', auth='client')
         return response.json()
 
-    def get_account_favorites(self, username, sort='newest', page=0, max_items=-1):
+    def iter_account_favorites(self, username, sort='newest', page=0, max_items=-1, prefetch=None):
 
-        if not self._configuration.get_access_token():
-            self.authorize()
+        self.require_access_token(username)
+
+        def fetch_page(page):
+            url = f'{self._api_url}/account/{username}/favorites/{page}/{sort}'
+            return self.get_url_data(url, endpoint='account_favorites', auth='bearer', account=username)
 
-        headers = {
-            'Authorization': 'Bearer %s' % self._configuration.get_access_token()
-        }
-        url = f'https://api.imgur.com/3/account/{username}/favorites/{page}/{sort}'
-        response = self.get_url_data(url, headers, None)
-        favorites = []
-        while len(response) != 0:
-            if (max_items >= 0) and (len(favorites) > max_items):
-                return favorites[:max_items]
-
-            log.info('Getting page %d of favorites' % page)
-            for item in response:
-                favorites.append(item)
-            url = f'https://api.imgur.com/3/account/{username}/favorites/{page}/{sort}'
-            response = self.get_url_data(url, headers, None)
-            page += 1
-
-        return favorites
+        return Paginator(fetch_page, page=page, max_items=max_items,
+                         prefetch=prefetch if prefetch is not None else self._configuration.get_prefetch_pages(),
+                         name='favorites')
+
+    def get_account_favorites(self, username, sort='newest', page=0, max_items=-1):
+        return list(self.iter_account_favorites(username, sort=sort, page=page, max_items=max_items))
 
     def get_account_submissions(self, username):
-        url = f'https://api.imgur.com/3/account/{username}/submissions/'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
+        url = f'{self._api_url}/account/{username}/submissions/'
+        response = self.request('GET', url, endpoint='account_submissions', auth='client')
         return response.json()
 
     def get_album(self, album_hash):
-        url = f'https://api.imgur.com/3/album/{album_hash}'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
-        return response.json()
+        url = f'{self._api_url}/album/{album_hash}'
+        return self.get_json(url, ttl=FOREVER, endpoint='album')[1]
 
     def get_gallery_album(self, gallery_hash):
-        url = f'https://api.imgur.com/3/gallery/{gallery_hash}'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
-        return response.json()
+        url = f'{self._api_url}/gallery/{gallery_hash}'
+        return self.get_json(url, ttl=FOREVER, endpoint='gallery')[1]
 
     def get_subreddit_gallery(self, subreddit, sort='time', window='day', page=0):
-        url = f'https://api.imgur.com/3/gallery/r/{subreddit}/{sort}/{window}/{page}'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
-        return response.json()
+        url = f'{self._api_url}/gallery/r/{subreddit}/{sort}/{window}/{page}'
+        return self.get_json(url, ttl=LISTING_TTL, endpoint='subreddit_gallery')[1]
 
     def get_subreddit_image(self, subreddit, image_id):
-        url = f'https://api.imgur.com/3/gallery/r/{subreddit}/{image_id}'
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
-        response = requests.request('GET', url, headers = headers)
-        return response.json()
+        url = f'{self._api_url}/gallery/r/{subreddit}/{image_id}'
+        return self.get_json(url, ttl=FOREVER, endpoint='subreddit_image')[1]
 
-    def get_tag(self, tag, sort='top', window='week', page=0, max_items=30):
-        headers = {
-            'Authorization': 'Client-ID %s' % self._configuration.get_client_id()
-        }
+    def iter_subreddit_gallery(self, subreddit, sort='time', window='day', page=0, max_items=30, prefetch=None):
+
+        def fetch_page(page):
+            return self.get_subreddit_gallery(subreddit, sort=sort, window=window, page=page)['data']
 
-        items = []
-        url = f'https://api.imgur.com/3/gallery/t/{tag}/{sort}/{window}/{page}'
-        response = self.get_url_data(url, headers, None)
+        return Paginator(fetch_page, page=page, max_items=max_items,
+                         prefetch=prefetch if prefetch is not None else self._configuration.get_prefetch_pages(),
+                         name='subreddit %s' % subreddit)
 
-        while len(response) != 0 and len(items) < max_items:
-            for item in response['items']:
-                items.append(item)
+    def iter_tag(self, tag, sort='top', window='week', page=0, max_items=30, prefetch=None):
 
-            url = f'https://api.imgur.com/3/gallery/t/{tag}/{sort}/{window}/{page}'
+        def fetch_page(page):
+            url = f'{self._api_url}/gallery/t/{tag}/{sort}/{window}/{page}'
             log.debug('Url to download: %s' % url)
-            response = self.get_url_data(url, headers, None)
-            page += 1
-        return items[:max_items + 1]
+            response = self.get_url_data(url, ttl=LISTING_TTL, endpoint='tag')
+            return response['items'] if response else []
+
+        return Paginator(fetch_page, page=page, max_items=max_items,
+                         prefetch=prefetch if prefetch is not None else self._configuration.get_prefetch_pages(),
+                         name='tag %s' % tag)
+
+    def get_tag(self, tag, sort='top', window='week', page=0, max_items=30):
+        return list(self.iter_tag(tag, sort=sort, window=window, page=page, max_items=max_items))
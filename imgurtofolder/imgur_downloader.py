@@ -1,21 +1,160 @@
 # Derek Santos
+from concurrent.futures import ThreadPoolExecutor
+from dircache import Directory_Cache
+from download_engine import Download_Engine
 from imgur import Imgur
+from manifest import COMPLETE, CORRUPT, open_manifest
+from pipeline import File_Task, prefetch
+from postprocess import Post_Processor
 from pprint import pformat
-from time import sleep
+from progress import Progress
+from store import Content_Store
+from time import perf_counter
+import bandwidth
+import hashlib
+import http.client
 import json
 import logs
 import os
 import re
 import requests
-import shutil
+import router
+import threading
+import urllib3
+
+PART_SUFFIX     = '.part'
+
+ORIGINAL = 'original'
+SMALLEST = 'smallest'
+CAPPED   = 'capped'
+VARIANTS = [ORIGINAL, SMALLEST, CAPPED]
+
+# Imgur's resized copies of still images: suffix added to the image id and
+# the longest side it is scaled down to. Largest first.
+RESIZED = [('h', 1024), ('l', 640), ('m', 320), ('t', 160)]
+RESUME_ATTEMPTS = 3
 
 log = logs.Log('downloader')
 
+
+def parse_content_range(header):
+    """ 'bytes 100-199/200' into (100, 200). The total is 0 when the server
+    sends '*', the start is None when the header can not be read. """
+    match = re.match(r'^\s*bytes\s+(\d+)-\d+/(\d+|\*)\s*$', header or '')
+    if match is None:
+        return None, 0
+    return int(match.group(1)), int(match.group(2)) if match.group(2) != '*' else 0
+
+
 class Imgur_Downloader(Imgur):
     def __init__(self, configuration, max_favorites):
 
         super().__init__(configuration)
         self._max_favorites = max_favorites
+        self._engine = Download_Engine(workers=configuration.get_workers(),
+                                       max_per_host=configuration.get_max_per_host())
+        self._manifests = {}
+        self._manifests_lock = threading.Lock()
+        self._stores = {}
+        self._progress = Progress(self.get_scheduler())
+        self._work_queue = None
+        self._plan = None
+        self._directories = Directory_Cache()
+        self._post_processor = None
+        self._buffers = threading.local()
+        self._unsynced = []
+        self._unsynced_lock = threading.Lock()
+        self._bandwidth = bandwidth.Bandwidth_Limiter(configuration.get_max_bandwidth(),
+                                                      configuration.get_bandwidth_schedule())
+
+    def get_manifest(self):
+        if not self._configuration.get_manifest():
+            return None
+
+        path = self.get_download_path()
+        with self._manifests_lock:
+            if path not in self._manifests:
+                self._manifests[path] = open_manifest(path)
+            return self._manifests[path]
+
+    def set_work_queue(self, work_queue):
+        """ Send resolved tasks to a shared Work_Queue instead of downloading them """
+        self._work_queue = work_queue
+
+    def set_plan(self, plan):
+        """ Collect resolved tasks into a Plan instead of downloading them """
+        self._plan = plan
+
+    def plan_summary(self):
+        """ Summary of the plan at the current download rate limit and bandwidth cap """
+        scheduler = self.get_scheduler()
+        manifest  = self.get_manifest()
+        return self._plan.summary(history=manifest.get_throughput() if manifest else None,
+                                  rate=scheduler.get_bucket('cdn').get_rate(),
+                                  bandwidth=self._bandwidth.get_rate(),
+                                  api_calls=self.get_api_calls(),
+                                  api_remaining=scheduler.get_total_remaining('api'),
+                                  api_rate=scheduler.get_total_rate('api'))
+
+    def get_directories(self):
+        return self._directories
+
+    def get_progress(self):
+        return self._progress
+
+    def start_progress(self, tty=True, status_path=None, interval=1.0):
+        self._progress.start(tty=tty, status_path=status_path, interval=interval)
+
+    def stop_progress(self):
+        self._progress.stop()
+
+    def get_store(self):
+        if not self._configuration.get_dedup():
+            return None
+
+        path = self.get_download_path()
+        with self._manifests_lock:
+            if path not in self._stores:
+                self._stores[path] = Content_Store(path)
+            return self._stores[path]
+
+    def get_post_processor(self):
+        if not (self._configuration.get_verify() or self._configuration.get_thumbnail_size()):
+            return None
+
+        with self._manifests_lock:
+            if self._post_processor is None:
+                self._post_processor = Post_Processor(verify=self._configuration.get_verify(),
+                                                      thumbnail_size=self._configuration.get_thumbnail_size())
+            return self._post_processor
+
+    def post_process(self, file_path, image_id):
+        download_path = self.get_download_path()
+        manifest      = self.get_manifest()
+        store         = self.get_store()
+
+        def on_invalid(file_path):
+            # Marked so the next run downloads it again
+            if manifest is None:
+                return
+            manifest.set_state(image_id, os.path.relpath(file_path, download_path), CORRUPT)
+            if store:
+                store_path = store.get_path(image_id, os.path.splitext(file_path)[1])
+                manifest.set_state(image_id, os.path.relpath(store_path, download_path), CORRUPT)
+
+        self.get_post_processor().submit(file_path, download_path, on_invalid)
+
+    def skip_album(self, id, source=None):
+        manifest = self.get_manifest()
+        if self.get_overwrite() or manifest is None:
+            return False
+
+        if manifest.is_album_complete(id):
+            log.info('Skipping album: %s' % id)
+            if self._plan is not None:
+                self._plan.add_present(source, *manifest.get_album_totals(id))
+            return True
+        return False
 
     def replace_characters(self, word):
         # NOTE: '\\/:*?"<>|.' are invalid folder characters in a file system
@@ -31,71 +170,93 @@ class Imgur_Downloader(Imgur):
         return word
 
     def parse_id(self, url, page=0, max_items=30, sort='time', window='day'):
-        imgur_base_extensions = {
-            'album' : [r'(/a/)(\w+)'],
-            'gallery' : [r'(/g/)(\w+)', r'(/gallery/)(\w+)'],
-            'subreddit' : [r'(/r/)(\w+)\/(\w+)', r'(/r/)(\w+)$'],
-            'tag' : [r'(/t/)(\w+)']
-        }
-
-        if any(re.search(item, url) for item in imgur_base_extensions['album']):
-            for item in imgur_base_extensions['album']:
-                result = re.search(item, url).group(2) if re.search(item, url) else None
-                if result:
-                    self.download_album(result)
-
-        elif any(re.search(item, url) for item in imgur_base_extensions['gallery']):
-            for item in imgur_base_extensions['gallery']:
-                result = re.search(item, url).group(2) if re.search(item, url) else None
-                if result:
-                    self.download_gallery(result)
-
-        elif any(re.search(item, url) for item in imgur_base_extensions['subreddit']):
-            for item in imgur_base_extensions['subreddit']:
-                if re.search(item, url) is None:
-                    continue
+        self.queue_tasks(self.iter_tasks(url, page=page, max_items=max_items,
+                                         sort=sort, window=window))
+
+    def iter_tasks(self, url, page=0, max_items=30, sort='time', window='day', source=None):
+        """ Resolve a url into the File_Tasks it expands to """
+        return self.iter_route_tasks(router.classify(url), page=page, max_items=max_items,
+                                     sort=sort, window=window, source=source)
 
-                subreddit = re.search(item, url).group(2)
-                id = re.search(item, url).group(3) if re.compile(item).groups > 2 else None
+    def iter_route_tasks(self, route, page=0, max_items=30, sort='time', window='day', source=None):
+        url    = route.url
+        source = source if source else url
 
-                if id is None and subreddit is not None:
-                    self.download_subreddit(subreddit, sort=sort, window=window, page=page, max_items=max_items)
+        if route.kind == router.ALBUM:
+            yield from self.iter_album_tasks(route.id, source=source)
 
-                elif subreddit is not None and id is not None:
-                    self.download_subreddit_gallery(subreddit, id)
+        elif route.kind == router.GALLERY:
+            yield from self.iter_gallery_tasks(route.id, source=source)
 
-        elif any(re.search(item, url) for item in imgur_base_extensions['tag']):
-            for item in imgur_base_extensions['tag']:
-                result = re.search(item, url).group(2) if re.search(item, url) else None
-                if result:
-                    self.download_tag(result, page=page, max_items=max_items)
+        elif route.kind == router.SUBREDDIT:
+            yield from self.iter_subreddit_tasks(route.subreddit, sort=sort, window=window, page=page,
+                                                 max_items=max_items, source=source)
+
+        elif route.kind == router.SUBREDDIT_ITEM:
+            yield from self.iter_subreddit_gallery_tasks(route.subreddit, route.id, source=source)
+
+        elif route.kind == router.TAG:
+            yield from self.iter_tag_tasks(route.id, page=page, max_items=max_items, source=source)
 
         else:
-            log.info('Downloading image: %s' % url[url.rfind('/') + 1:])
-            self.download(url[url.rfind('/') + 1:], url, self.get_download_path())
+            filename = url[url.rfind('/') + 1:]
+            log.info('Downloading image: %s' % filename)
+            yield File_Task(filename, url, self.get_download_path(),
+                            image_id=route.id, source=source)
+
+    def iter_link_tasks(self, links, page=0, max_items=30, source=None):
+        # A broken link should not end the whole listing it came from
+        for link in links:
+            try:
+                yield from self.iter_tasks(link, page=page, max_items=max_items, source=source)
+            except Exception:
+                log.exception('Error with url {}. Error Message: \n\n'.format(link))
 
     def get_image_link(self, image):
+        """ Link and file extension to download for `image`, following the
+        configured variant policy. Only the image metadata is used.
+
+        original  mp4 for animations, otherwise the uploaded file
+        smallest  for animations whichever of mp4 and gif is smaller
+        capped    like smallest, and still images larger than the
+                  resolution cap are replaced by Imgur's resized copy
+        """
+        variant = self._configuration.get_variant()
+
         if 'mp4' in image:
             image_link = image['mp4']
-            filetype = '.mp4'
         elif 'gifv' in image:
-            image_link = image['gifv']
-            filetype = '.gif'
+            # gifv links are an html page around the mp4
+            image_link = image['gifv'][:-len('.gifv')] + '.mp4'
         else:
             image_link = image['link']
-            filetype = image_link[image_link.rfind('.'):]
 
-        return image_link, filetype
+        if variant != ORIGINAL and image_link.endswith('.mp4') and image['link'].endswith('.gif'):
+            if image.get('size') and image.get('mp4_size') and image['size'] < image['mp4_size']:
+                image_link = image['link']
+
+        if variant == CAPPED and not image.get('animated'):
+            image_link = self.get_resized_link(image, image_link)
+
+        return image_link, image_link[image_link.rfind('.'):]
+
+    def get_resized_link(self, image, image_link):
+        longest = max(image.get('width') or 0, image.get('height') or 0)
+        cap = self._configuration.get_max_resolution()
+        if not cap or longest <= cap:
+            return image_link
+
+        # The largest copy within the cap, or the smallest one there is
+        suffix = next((suffix for suffix, size in RESIZED if size <= cap), RESIZED[-1][0])
+        extension = image_link.rfind('.')
+        return image_link[:extension] + suffix + image_link[extension:]
 
     def mkdir(self, path):
-        log.debug("Checking if folder exists")
-        if not os.path.exists(path):
-            log.debug("Creating folder: %s" % path)
-            os.makedirs(path)
+        self._directories.makedirs(path)
 
-    def download_tag(self, id, page=0, max_items=30):
+    def iter_tag_tasks(self, id, page=0, max_items=30, source=None):
         log.debug('Getting tag details')
-        items = self.get_tag(id, page=page, max_items=max_items)
+        items = self.iter_tag(id, page=page, max_items=max_items)
 
         # For each item in tag. Items are "albums"
         for item in items:
@@ -104,34 +265,33 @@ class Imgur_Downloader(Imgur):
                 tag_root_title = item['title'] if item['title'] else item['id']
                 tag_root_title = self.replace_characters(tag_root_title)
                 tag_root_path  = os.path.join(self.get_download_path(), tag_root_title)
-                self.mkdir(tag_root_path)
 
                 for position, sub_image in enumerate(item['images'], start=1):
                     title = sub_image['title'] if sub_image['title'] else sub_image['id']
                     title = self.replace_characters(title)
                     path  = os.path.join(tag_root_path, title)
 
-                    self.mkdir(path)
-
                     log.info('Downloading tag: %s' % title)
                     image_link, filetype = self.get_image_link(sub_image)
                     image_filename = "{} - {}{}".format(sub_image['id'], position, filetype)
-                    self.download(image_filename, image_link, path)
+                    yield File_Task(image_filename, image_link, path, image_id=sub_image['id'],
+                                    album_id=item['id'], source=source, metadata=sub_image)
 
             else:
                 title = item['title'] if item['title'] else item['id']
                 title = self.replace_characters(title)
                 path  = os.path.join(self.get_download_path(), title)
 
-                self.mkdir(path)
-
                 log.info('Downloading tag: %s' % title)
-                image_link, filetype = self.get_image_link(sub_image)
-                image_filename = "{} - {}{}".format(sub_image['id'], position, filetype)
-                self.download(image_filename, image_link, path)
+                image_link, filetype = self.get_image_link(item)
+                image_filename = image_link[image_link.rfind('/') + 1:]
+                yield File_Task(image_filename, image_link, path, image_id=item['id'],
+                                source=source, metadata=item)
 
+    def iter_album_tasks(self, id, source=None):
 
-    def download_album(self, id):
+        if self.skip_album(id, source=source):
+            return
 
         log.debug('Getting album details')
         album = self.get_album(id)['data']
@@ -139,20 +299,21 @@ class Imgur_Downloader(Imgur):
         title = self.replace_characters(title)
         path  = os.path.join(self.get_download_path(), title)
 
-        log.debug("Checking if folder exists")
-        if not os.path.exists(path):
-            log.debug("Creating folder: %s" % path)
-            os.makedirs(path)
+        if self.get_manifest():
+            self.get_manifest().add_album(id, len(album['images']))
 
         log.info('Downloading album: %s' % title)
         for position, image in enumerate(album['images'], start=1):
             image_link, filetype = self.get_image_link(image)
             image_filename = "{} - {}{}".format(album['id'], position, filetype)
 
-            self.download(image_filename, image_link, path)
+            yield File_Task(image_filename, image_link, path, image_id=image['id'],
+                            album_id=id, source=source, metadata=image)
 
+    def iter_gallery_tasks(self, id, source=None):
 
-    def download_gallery(self, id):
+        if self.skip_album(id, source=source):
+            return
 
         log.debug('Getting Gallery details')
         album = self.get_gallery_album(id)['data']
@@ -160,67 +321,111 @@ class Imgur_Downloader(Imgur):
         title = self.replace_characters(title)
         path  = os.path.join(self.get_download_path(), title)
 
-        log.debug("Checking if folder exists")
-        if not os.path.exists(path):
-            log.debug("Creating folder: %s" % path)
-            os.makedirs(path)
-
         if 'images' in album:
+            if self.get_manifest():
+                self.get_manifest().add_album(id, len(album['images']))
+
             log.info('Downloading gallery %s' % album['id'])
             for position, image in enumerate(album['images'], start=1):
                 image_link, filetype = self.get_image_link(image)
                 filename = album['id'] + ' - ' + str(position) + filetype
-                self.download(filename, image_link, path)
+                yield File_Task(filename, image_link, path, image_id=image['id'],
+                                album_id=id, source=source, metadata=image)
 
         else:
+            if self.get_manifest():
+                self.get_manifest().add_album(id, 1)
+
             image_link, filetype = self.get_image_link(album)
             filename = image_link[image_link.rfind('/') + 1:]
             log.info('Downloading gallery image: %s' % filename)
-            self.download(filename, image_link, path)
-
-    def download_subreddit(self, subreddit, sort='time', window='day', page=0, max_items=30):
-        log.debug("Getting subreddit details")
-        subreddit_data = []
-        response = self.get_subreddit_gallery(subreddit, sort=sort, window=window, page=page)['data']
+            yield File_Task(filename, image_link, path, image_id=album['id'],
+                            album_id=id, source=source, metadata=album)
 
-        while len(subreddit_data) < max_items and len(response) != 0:
-            subreddit_data += response
-            page += 1
-            response = self.get_subreddit_gallery(subreddit, sort, window, page)['data']
+    def iter_subreddit_tasks(self, subreddit, sort='time', window='day', page=0, max_items=30, source=None):
+        log.debug("Resolving subreddit items")
+        items = self.iter_subreddit_gallery(subreddit, sort=sort, window=window,
+                                            page=page, max_items=max_items)
+        yield from self.iter_link_tasks((item["link"] for item in items), page, max_items, source=source)
 
-        log.debug("Sending subreddit items to parse_id")
-        for position, item in enumerate(subreddit_data):
-            if position + 1 <= max_items:
-                self.parse_id(item["link"], page, max_items)
-
-    def download_subreddit_gallery(self, subreddit, id):
+    def iter_subreddit_gallery_tasks(self, subreddit, id, source=None):
 
         log.debug('Getting subreddit gallery details')
         subreddit_album = self.get_subreddit_image(subreddit, id)['data']
         title = subreddit_album['title'] if subreddit_album['title'] else subreddit_album['id']
         title = self.replace_characters(title)
-        path  = self.get_download_path()
-
-        log.debug("Checking if folder exists")
-        if not os.path.exists(path):
-            log.debug("Creating folder: %s" % path)
-            os.makedirs(path)
 
         log.info('Downloading subreddit gallery image: %s' % title)
         image_link, filetype = self.get_image_link(subreddit_album)
         filename = image_link[image_link.rfind('/') + 1:]
-        self.download(filename, image_link, self.get_download_path())
+        yield File_Task(filename, image_link, self.get_download_path(), image_id=subreddit_album['id'],
+                        source=source, metadata=subreddit_album)
 
+    def iter_favorites_tasks(self, username, latest=True, page=0, max_items=None):
+        log.info("Getting account favorites")
+        favorites = self.iter_account_favorites(username = username,
+                                                sort = 'oldest' if not latest else 'newest',
+                                                page=page,
+                                                max_items=max_items)
+        yield from self.iter_link_tasks((favorite['link'] for favorite in favorites),
+                                        source='favorites:%s' % username)
+
+    def iter_account_images_tasks(self, username, page=0, max_items=None):
+        account_images = self.iter_account_images(username, page=page,
+                                                  max_items=max_items if max_items else -1)
+        yield from self.iter_link_tasks((image['link'] for image in account_images),
+                                        source='account:%s' % username)
+
+    def download_urls(self, urls, page=0, max_items=30, sort='time', window='day'):
+        """ Resolve and download a stream of urls in parallel.
+
+        Urls that point at the same album, gallery, tag or image are only
+        resolved once.
+        """
+        seen = set()
+        workers = self._configuration.get_resolve_workers()
+        slots = threading.BoundedSemaphore(workers * 2)
+
+        def resolve(route):
+            try:
+                for task in self.iter_route_tasks(route, page=page, max_items=max_items,
+                                                  sort=sort, window=window):
+                    self.queue_task(task)
+            except Exception:
+                log.exception('Error with url {}. Error Message: \n\n'.format(route.url))
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='itf-resolve') as executor:
+            for route in router.classify_many(urls):
+                key = router.route_key(route)
+                if key in seen:
+                    log.debug('Skipping duplicate url: %s' % route.url)
+                    continue
+                seen.add(key)
+
+                slots.acquire()
+                executor.submit(resolve, route)
+
+    def download_tag(self, id, page=0, max_items=30):
+        self.queue_tasks(self.iter_tag_tasks(id, page=page, max_items=max_items))
+
+    def download_album(self, id):
+        self.queue_tasks(self.iter_album_tasks(id))
+
+    def download_gallery(self, id):
+        self.queue_tasks(self.iter_gallery_tasks(id))
+
+    def download_subreddit(self, subreddit, sort='time', window='day', page=0, max_items=30):
+        self.queue_tasks(self.iter_subreddit_tasks(subreddit, sort=sort, window=window,
+                                                   page=page, max_items=max_items))
+
+    def download_subreddit_gallery(self, subreddit, id):
+        self.queue_tasks(self.iter_subreddit_gallery_tasks(subreddit, id))
 
     def download_favorites(self, username, latest=True, page=0, max_items=None):
-        log.info("Getting account favorites")
-        favorites = self.get_account_favorites(username = username,
-                                                      sort = 'oldest' if not latest else 'newest',
-                                                      page=page,
-                                                      max_items=max_items)
-        log.debug('Number of favorites: %d' % len(favorites))
-        for favorite in favorites:
-            self.parse_id(favorite['link'])
+        self.queue_tasks(self.iter_favorites_tasks(username, latest=latest, page=page,
+                                                   max_items=max_items))
 
     def list_favorites(self, username, latest=True, page=0, max_items=-1):
         favorites = self.get_account_favorites(username = username,
@@ -230,36 +435,305 @@ class Imgur_Downloader(Imgur):
         log.info(pformat(favorites))
 
     def download_account_images(self, username, page=0, max_items=None):
-        account_images = self.get_account_images(username, page=page)
-
-        if max_items:
-            account_images = account_images[:max_items]
-
-        for image in account_images:
-            self.parse_id(image['link'])
-
-    def download(self, filename, url, path):
-
-        log.debug('Checking that folder path exists')
-        if not os.path.exists(path):
-            log.debug('Creating folder path')
-            os.makedirs(path)
+        self.queue_tasks(self.iter_account_images_tasks(username, page=page, max_items=max_items))
+
+    def queue_tasks(self, tasks):
+        # Resolution runs ahead in its own thread while the engine downloads
+        for task in prefetch(tasks):
+            self.queue_task(task)
+
+    def queue_task(self, task):
+        task_filter = self._configuration.get_task_filter()
+        if task_filter is not None and not task_filter.accept(task):
+            return None
+
+        if self._plan is not None:
+            self._plan.add(task, present=not self.get_overwrite() and
+                           self.is_present(os.path.join(task.path, task.filename), task.image_id))
+            return None
+
+        if self._work_queue is not None:
+            if self._work_queue.put(task, self.get_download_path()):
+                self._progress.discovered()
+            return None
+
+        return self.queue_download(task.filename, task.url, task.path,
+                                   image_id=task.image_id, album_id=task.album_id, source=task.source)
+
+    def queue_download(self, filename, url, path, image_id=None, album_id=None, source=None):
+        self._progress.discovered()
+        return self._engine.submit(self.download, url, filename, url, path,
+                                   image_id=image_id, album_id=album_id, source=source)
+
+    def wait(self):
+        self._engine.wait()
+        if self._post_processor is not None:
+            self._post_processor.wait()
+
+    def download(self, filename, url, path, image_id=None, album_id=None, source=None):
+        self._progress.started()
+        state = 'failed'
+        try:
+            state = self.download_file(filename, url, path, image_id=image_id, album_id=album_id,
+                                       source=source)
+        finally:
+            self._progress.finished(state)
+
+        if state == 'completed' and self.get_post_processor():
+            self.post_process(os.path.join(path, filename),
+                              image_id if image_id is not None else os.path.splitext(filename)[0])
+        return state
+
+    def is_present(self, file_path, image_id):
+        """ True if file_path is already downloaded completely """
+        manifest = self.get_manifest()
+        if manifest is None:
+            return self._directories.exists(file_path)
+
+        if image_id is None:
+            image_id = os.path.splitext(os.path.basename(file_path))[0]
+
+        # Files from before the manifest existed are trusted as complete
+        image = manifest.get_image(image_id, os.path.relpath(file_path, self.get_download_path()))
+        return image['state'] == COMPLETE if image else self._directories.exists(file_path)
+
+    def download_file(self, filename, url, path, image_id=None, album_id=None, source=None):
+        """ Returns 'completed', 'skipped' or 'failed' """
+        file_path     = os.path.join(path, filename)
+        relative_path = os.path.relpath(file_path, self.get_download_path())
+        manifest      = self.get_manifest()
+        if image_id is None:
+            image_id = os.path.splitext(filename)[0]
 
         log.debug('Checking to overwrite')
-        if not self.get_overwrite() and os.path.exists(os.path.join(path, filename)):
+        if not self.get_overwrite() and self.is_present(file_path, image_id):
             log.info('\tSkipping %s' % filename)
-            return
+            return 'skipped'
 
-        req = requests.get(url, stream=True)
-        if req.status_code == 200:
-            file_size = int(req.headers.get('content-length', 0)) / float(1 << 20)
-            log.info('\t%s, File Size: %.2f MB' % (filename, file_size))
-            with open(os.path.join(path, filename), 'wb') as image_file:
-                req.raw.decode_content = True
-                shutil.copyfileobj(req.raw, image_file)
+        self.mkdir(path)
+
+        if manifest:
+            manifest.start(image_id, relative_path, album_id)
+
+        if self.get_store():
+            result = self.fetch_stored(filename, url, file_path, image_id, source=source)
         else:
-            log.info('\tERROR! Can not download: ' + os.path.join(path, filename))
+            result = self.fetch_resuming(filename, url, file_path, source=source)
+
+        if result is None:
+            return 'failed'
+
+        if manifest:
+            size, digest = result
+            manifest.complete(image_id, relative_path, size, digest, album_id)
+        return 'completed'
+
+    def fetch_resuming(self, filename, url, file_path, source=None):
+        for attempt in range(RESUME_ATTEMPTS):
+            try:
+                return self.fetch(filename, url, file_path, source=source)
+            except (requests.RequestException, urllib3.exceptions.HTTPError,
+                    http.client.HTTPException, ConnectionError, TimeoutError) as e:
+                log.info('\tConnection lost while downloading %s, resuming (%s)' % (filename, e))
+
+        log.info('\tERROR! Gave up on: ' + file_path)
+        return None
+
+    def fetch_stored(self, filename, url, file_path, image_id, source=None):
+        """ Fetch an image into the content store once and link it into place.
+        Stored by the name of the link, so Imgur's resized copies and the
+        original of an image are kept apart. """
+        store      = self.get_store()
+        manifest   = self.get_manifest()
+        variant_id = os.path.splitext(url[url.rfind('/') + 1:].split('?')[0])[0]
+        store_path = store.get_path(variant_id if variant_id else image_id, os.path.splitext(filename)[1])
+        store_relative_path = os.path.relpath(store_path, self.get_download_path())
+
+        with store.lock(store_path):
+            stored = manifest.get_image(image_id, store_relative_path) if manifest else None
+            if stored and stored['state'] == COMPLETE and self._directories.exists(store_path):
+                log.info('\t%s, Already stored' % filename)
+                result = stored['size'], stored['hash']
+            elif not manifest and self._directories.exists(store_path):
+                log.info('\t%s, Already stored' % filename)
+                result = os.path.getsize(store_path), None
+            else:
+                self.mkdir(os.path.dirname(store_path))
+                result = self.fetch_resuming(filename, url, store_path, source=source)
+                if result is None:
+                    return None
+                if manifest:
+                    manifest.complete(image_id, store_relative_path, result[0], result[1])
+
+        store.link(store_path, file_path)
+        self._directories.added(file_path)
+        return result
+
+    def record_download(self, req, transfer=0.0, disk=0.0, size=0):
+        if self.get_recorder() is None:
+            return
+        self.get_recorder().record('download', req.status_code, ttfb=req.elapsed.total_seconds(),
+                                   transfer=transfer, disk=disk, size=size, retries=req.retries,
+                                   remaining=self.get_scheduler().get_remaining('cdn'))
+
+    def fetch(self, filename, url, file_path, source=None):
+        """ Stream url into file_path through a .part file.
+
+        An existing .part file is resumed with a Range request. The file is
+        only renamed into place once its size matches the server's.
+        Returns (size, sha256) or None on failure.
+        """
+        part_path = file_path + PART_SUFFIX
+        existing  = os.path.getsize(part_path) if self._directories.exists(part_path) else 0
+
+        # Identity encoding keeps byte offsets and content-length meaningful
+        headers = {'Accept-Encoding': 'identity'}
+        if existing:
+            headers['Range'] = 'bytes=%d-' % existing
+
+        req = self.request('GET', url, budget='cdn', stream=True, headers=headers, endpoint='download')
+        if req.status_code == 416:
+            log.debug('Range not satisfiable, restarting %s' % filename)
+            req.close()
+            os.remove(part_path)
+            self._directories.removed(part_path)
+            return self.fetch(filename, url, file_path, source=source)
+
+        if req.status_code not in (200, 206):
+            self.record_download(req)
+            log.info('\tERROR! Can not download: ' + file_path)
             log.info('\tStatus code: ' + str(req.status_code))
-
-        # Delaying so no timeout
-        sleep(.1)
+            req.close()
+            return None
+
+        digest = hashlib.sha256()
+        if req.status_code == 206:
+            start, expected = parse_content_range(req.headers.get('content-range'))
+            if start != existing:
+                log.debug('Range does not start at %d (%s), restarting %s'
+                          % (existing, req.headers.get('content-range'), filename))
+                req.close()
+                os.remove(part_path)
+                self._directories.removed(part_path)
+                return self.fetch(filename, url, file_path, source=source)
+            mode = 'r+b'
+            with open(part_path, 'rb') as part_file:
+                for chunk in iter(lambda: part_file.read(self._configuration.get_chunk_size()), b''):
+                    digest.update(chunk)
+            size = existing
+            log.info('\t%s, Resuming at %.2f of %.2f MB' % (filename, existing / float(1 << 20),
+                                                           expected / float(1 << 20)))
+        else:
+            # A server that ignores the Range header sends the whole file
+            expected = int(req.headers.get('content-length', 0))
+            mode = 'wb'
+            existing = size = 0
+            log.info('\t%s, File Size: %.2f MB' % (filename, expected / float(1 << 20)))
+
+        # Hash while streaming so the file never has to be read back.
+        # Network and disk (write + hash) time are timed separately.
+        buffer = self.get_buffer()
+        readinto = self.get_readinto(req)
+        limited = self._bandwidth.is_enabled()
+        network = disk = 0.0
+        if limited:
+            buffer = buffer[:bandwidth.CHUNK_SIZE]
+            self._bandwidth.start(source)
+        with open(part_path, mode) as image_file:
+            self._directories.added(part_path)
+            image_file.seek(existing)
+            allocated = self.preallocate(image_file, existing, expected)
+            try:
+                while True:
+                    started = perf_counter()
+                    read_size = readinto(buffer)
+                    read = perf_counter()
+                    network += read - started
+                    if not read_size:
+                        break
+                    if limited:
+                        # Charged for what arrived; the wait holds back the next read
+                        self._bandwidth.consume(source, read_size)
+                        read = perf_counter()
+                    chunk = buffer[:read_size]
+                    image_file.write(chunk)
+                    digest.update(chunk)
+                    size += read_size
+                    disk += perf_counter() - read
+                    self._progress.transferred(read_size)
+            finally:
+                if limited:
+                    self._bandwidth.finish(source)
+                # A preallocated tail would be taken for data when resuming
+                if size < allocated:
+                    image_file.truncate(size)
+
+        if readinto != req.raw.readinto:
+            req.raw.release_conn()
+        self.record_download(req, transfer=network, disk=disk, size=size - existing)
+
+        if expected and size != expected:
+            log.info('\tERROR! Incomplete download of %s (%d of %d bytes)' % (filename, size, expected))
+            return None
+
+        os.replace(part_path, file_path)
+        self._directories.removed(part_path)
+        self._directories.added(file_path)
+        self.sync_written(file_path)
+        return size, digest.hexdigest()
+
+    def get_buffer(self):
+        """ Read buffer reused by every download on the current thread """
+        chunk_size = self._configuration.get_chunk_size()
+        buffer = getattr(self._buffers, 'buffer', None)
+        if buffer is None or len(buffer) != chunk_size:
+            buffer = self._buffers.buffer = memoryview(bytearray(chunk_size))
+        return buffer
+
+    def get_readinto(self, req):
+        # urllib3's readinto copies through a temporary bytes object, the
+        # http.client response underneath reads straight into the buffer
+        response = getattr(req.raw, '_fp', None)
+        if response is not None and hasattr(response, 'readinto'):
+            return response.readinto
+        return req.raw.readinto
+
+    def preallocate(self, image_file, offset, expected):
+        """ Reserve the rest of the file in one go so it is laid out
+        contiguously. Returns the size allocated, 0 if nothing was. """
+        if expected <= offset or not hasattr(os, 'posix_fallocate'):
+            return 0
+        try:
+            os.posix_fallocate(image_file.fileno(), offset, expected - offset)
+        except OSError:
+            log.debug('Could not preallocate %s' % image_file.name, exc_info=True)
+            return 0
+        return expected
+
+    def sync_written(self, file_path):
+        """ Flush finished files, and the folders they were renamed in,
+        to disk every `fsync_every` files """
+        fsync_every = self._configuration.get_fsync_every()
+        if not fsync_every:
+            return
+        with self._unsynced_lock:
+            self._unsynced.append(file_path)
+            if len(self._unsynced) < fsync_every:
+                return
+            batch, self._unsynced = self._unsynced, []
+
+        log.debug('Syncing %d downloaded files to disk' % len(batch))
+        folders = set(os.path.dirname(path) for path in batch)
+        for path in batch + sorted(folders):
+            try:
+                descriptor = os.open(path, os.O_RDONLY)
+            except OSError:
+                log.debug('Could not open %s to sync it' % path, exc_info=True)
+                continue
+            try:
+                os.fsync(descriptor)
+            except OSError:
+                # Folders can not be synced on some platforms
+                log.debug('Could not sync %s' % path, exc_info=True)
+            finally:
+                os.close(descriptor)
@@ -0,0 +1,124 @@
+# Derek Santos
+from math import ceil
+from time import time
+import csv
+import json
+import logs
+import random
+import threading
+
+log = logs.Log('instrumentation')
+
+TIMINGS     = ['ttfb', 'transfer', 'disk', 'total']
+PERCENTILES = [50, 95, 99]
+
+# Timings kept per endpoint for percentiles. Past this many requests a
+# uniform sample is kept, so memory stays flat however long the run is.
+RESERVOIR_SIZE = 2048
+
+
+def percentile(values, percent):
+    """ Nearest-rank percentile of an already sorted list """
+    if not values:
+        return None
+    return values[max(1, ceil(percent / 100.0 * len(values))) - 1]
+
+
+class Endpoint_Stats:
+    """ Running totals of one endpoint plus a reservoir sample of timings """
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.requests       = 0
+        self.errors         = 0
+        self.retries        = 0
+        self.bytes          = 0
+        self.min_remaining  = None
+        self._reservoir_size = reservoir_size
+        self._timings       = []
+        self._random        = random.Random(0)
+
+    def add(self, status, ttfb, transfer, disk, size, retries, remaining):
+        # ttfb is the time until response headers arrived (connection setup
+        # included), transfer the time spent reading the body, disk the time
+        # spent writing it. remaining is the rate limit headroom after it.
+        self.requests += 1
+        self.errors   += status >= 400
+        self.retries  += retries
+        self.bytes    += size
+        if remaining is not None and (self.min_remaining is None or remaining < self.min_remaining):
+            self.min_remaining = remaining
+
+        timing = (ttfb, transfer, disk, ttfb + transfer + disk)
+        if len(self._timings) < self._reservoir_size:
+            self._timings.append(timing)
+        else:
+            slot = self._random.randrange(self.requests)
+            if slot < self._reservoir_size:
+                self._timings[slot] = timing
+
+    def get_timings(self, name):
+        column = TIMINGS.index(name)
+        return sorted(timing[column] for timing in self._timings)
+
+
+class Recorder:
+    """ Aggregates every API call and download per endpoint """
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self._endpoints = {}
+        self._reservoir_size = reservoir_size
+        self._lock      = threading.Lock()
+        self._started   = time()
+
+    def record(self, endpoint, status, ttfb=0.0, transfer=0.0, disk=0.0, size=0,
+               retries=0, remaining=None):
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = Endpoint_Stats(self._reservoir_size)
+            self._endpoints[endpoint].add(status, ttfb, transfer, disk, size, retries, remaining)
+
+    def get_requests(self, endpoint=None):
+        with self._lock:
+            if endpoint is not None:
+                return self._endpoints[endpoint].requests if endpoint in self._endpoints else 0
+            return sum(stats.requests for stats in self._endpoints.values())
+
+    def summary(self):
+        duration = max(time() - self._started, 1e-9)
+
+        summary = {}
+        with self._lock:
+            for endpoint, stats in sorted(self._endpoints.items()):
+                result = {'requests'          : stats.requests,
+                          'errors'            : stats.errors,
+                          'retries'           : stats.retries,
+                          'bytes'             : stats.bytes,
+                          'requests_per_sec'  : stats.requests / duration,
+                          'mb_per_sec'        : stats.bytes / float(1 << 20) / duration,
+                          'min_remaining'     : stats.min_remaining}
+
+                for timing in TIMINGS:
+                    values = stats.get_timings(timing)
+                    for percent in PERCENTILES:
+                        result['%s_p%d' % (timing, percent)] = percentile(values, percent)
+
+                summary[endpoint] = result
+        return summary
+
+    def write_report(self, path):
+        log.info('Writing run report: %s' % path)
+        summary = self.summary()
+
+        if path.endswith('.csv'):
+            columns = ['endpoint'] + sorted({key for result in summary.values() for key in result})
+            with open(path, 'w', newline='') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=columns)
+                writer.writeheader()
+                for endpoint, result in summary.items():
+                    writer.writerow(dict(result, endpoint=endpoint))
+        else:
+            with open(path, 'w') as report_file:
+                json.dump({'started'   : self._started,
+                           'finished'  : time(),
+                           'endpoints' : summary},
+                          report_file, sort_keys=True, indent=4)
@@ -0,0 +1,103 @@
+# Derek Santos
+""" Job files describe several credentials and sources for one run.
+
+    {
+        "credentials": [
+            {"name": "main", "client_id": "...", "access_token": "...", "account": "username"},
+            {"name": "spare", "client_id": "..."}
+        ],
+        "sources": [
+            "https://imgur.com/r/pics",
+            {"url": "https://imgur.com/t/cats", "max_items": 200, "sort": "top", "window": "week"},
+            {"favorites": "username", "oldest": true, "max_items": 500},
+            {"account_images": "username"}
+        ]
+    }
+
+Client-ID calls go to whichever credential has the most quota left.
+Favorites and account images use the credential whose `account` matches,
+or any credential with an access token.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logs
+import os
+
+log = logs.Log('job')
+
+SOURCE_KINDS = ['url', 'favorites', 'account_images']
+
+
+class Job:
+    def __init__(self, credentials=(), sources=(), download_path=None):
+        self._credentials   = list(credentials)
+        self._sources       = list(sources)
+        self._download_path = download_path
+
+    def get_credentials(self):
+        return self._credentials
+
+    def get_sources(self):
+        return self._sources
+
+    def get_download_path(self):
+        return self._download_path
+
+    def apply(self, downloader):
+        """ Register the job's credentials and download path with a downloader """
+        for credential in self._credentials:
+            downloader.add_credential(credential['name'], credential['client_id'],
+                                      credential.get('access_token', ''), credential.get('account'))
+        if self._download_path:
+            downloader.set_download_path(os.path.expanduser(self._download_path))
+
+    def run_source(self, downloader, source, page=0, max_items=30):
+        max_items = source.get('max_items', max_items)
+        page      = source.get('page', page)
+        if 'favorites' in source:
+            downloader.download_favorites(source['favorites'], latest=not source.get('oldest', False),
+                                          page=page, max_items=max_items)
+        elif 'account_images' in source:
+            downloader.download_account_images(source['account_images'], page=page, max_items=max_items)
+        else:
+            downloader.queue_tasks(downloader.iter_tasks(source['url'], page=page, max_items=max_items,
+                                                         sort=source.get('sort', 'time'),
+                                                         window=source.get('window', 'day')))
+
+    def run(self, downloader, page=0, max_items=30):
+        """ Resolve every source at the same time into the downloader's queue """
+        workers = max(1, min(len(self._sources), downloader.get_resolve_workers()))
+
+        def run_source(source):
+            try:
+                self.run_source(downloader, source, page=page, max_items=max_items)
+            except Exception:
+                log.exception('Error with job source {}. Error Message: \n\n'.format(source))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='itf-job') as executor:
+            for source in self._sources:
+                executor.submit(run_source, source)
+
+
+def parse_source(source):
+    if isinstance(source, str):
+        source = {'url': source}
+    if not any(kind in source for kind in SOURCE_KINDS):
+        raise ValueError('Job source needs one of %s: %s' % (', '.join(SOURCE_KINDS), source))
+    return source
+
+
+def load_job(path):
+    log.debug('Loading job file: %s' % path)
+    with open(os.path.expanduser(path), 'r') as job_file:
+        data = json.load(job_file)
+
+    credentials = data.get('credentials', [])
+    for position, credential in enumerate(credentials):
+        if not credential.get('client_id'):
+            raise ValueError('Job credential %d has no client_id' % position)
+        credential.setdefault('name', 'job%d' % position)
+
+    return Job(credentials=credentials,
+               sources=[parse_source(source) for source in data.get('sources', [])],
+               download_path=data.get('download_path'))
@@ -1,4 +1,6 @@
 import logging
+import sys
+import threading
 
 """
 Level | Numeric value
@@ -10,6 +12,38 @@ INFO 20
 DEBUG 10
 NOTSET 0
 """
+# The line kept at the bottom of the terminal by --progress, None if none
+_status_line = None
+_status_lock = threading.Lock()
+
+
+def set_status_line(line):
+    """ Show `line` in place of the previous one on stderr. None ends the
+    status line, leaving its last text on screen. """
+    global _status_line
+    with _status_lock:
+        if line is None:
+            if _status_line is not None:
+                sys.stderr.write('\n')
+        else:
+            sys.stderr.write('\r\033[K' + line)
+        sys.stderr.flush()
+        _status_line = line
+
+
+class Status_Stream_Handler(logging.StreamHandler):
+    """ Writes records above the status line instead of through it """
+
+    def emit(self, record):
+        with _status_lock:
+            if _status_line is not None:
+                self.stream.write('\r\033[K')
+            super().emit(record)
+            if _status_line is not None:
+                self.stream.write(_status_line)
+                self.flush()
+
+
 class Log:
     def __init__(self, name, level=logging.INFO):
         self._log = logging.getLogger(name)
@@ -25,7 +59,7 @@ class Log:
         self._formatter = logging.Formatter(format_log, datefmt=format_date)
 
         # Handler for screen output
-        self._stream_handler = logging.StreamHandler()
+        self._stream_handler = Status_Stream_Handler()
         self._stream_handler.setLevel(level)
         self._stream_handler.setFormatter(self._formatter)
         self._log.addHandler(self._stream_handler)
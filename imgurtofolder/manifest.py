@@ -0,0 +1,181 @@
+# Derek Santos
+from time import time
+import json
+import logs
+import os
+import sqlite3
+import threading
+
+log = logs.Log('manifest')
+
+MANIFEST_FILENAME = '.itf_manifest.sqlite3'
+
+PARTIAL  = 'partial'
+COMPLETE = 'complete'
+CORRUPT  = 'corrupt'
+
+# SQLite's WAL mode needs shared memory between every process using the
+# database, which network filesystems can not provide
+NETWORK_FILESYSTEMS = ['nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph',
+                       'glusterfs', 'lustre', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.cephfs']
+
+# Download history used to estimate how long new files take. Completions
+# further apart than HISTORY_GAP seconds belong to different runs.
+HISTORY_FILES = 1000
+HISTORY_GAP   = 60
+
+
+def get_filesystem(path):
+    """ Filesystem type of the mount `path` is on, None if it can not be told """
+    path = os.path.realpath(path)
+    try:
+        with open('/proc/mounts', 'r') as mounts:
+            entries = [line.split()[1:3] for line in mounts if len(line.split()) > 2]
+    except OSError:
+        return None
+
+    filesystem, longest = None, -1
+    for mount_point, mount_type in entries:
+        mount_point = mount_point.replace('\\040', ' ')
+        inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+        if inside and len(mount_point) > longest:
+            filesystem, longest = mount_type, len(mount_point)
+    return filesystem
+
+
+def is_network_path(path):
+    return get_filesystem(path) in NETWORK_FILESYSTEMS
+
+
+def journal_mode(path):
+    """ WAL on local disks, a rollback journal on network filesystems """
+    return 'DELETE' if is_network_path(os.path.dirname(os.path.abspath(path))) else 'WAL'
+
+
+class Manifest:
+    """ On-disk record of every file downloaded into a download path.
+
+    Images are keyed by Imgur image id and final path. Albums remember how
+    many images they hold so a finished album can be skipped before any API
+    call is made.
+    """
+
+    def __init__(self, path):
+        log.debug('Opening manifest: %s' % path)
+        self._path       = path
+        self._lock       = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=%s' % journal_mode(path))
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                id       TEXT NOT NULL,
+                path     TEXT NOT NULL,
+                album_id TEXT,
+                size     INTEGER,
+                hash     TEXT,
+                state    TEXT NOT NULL,
+                updated  REAL NOT NULL,
+                PRIMARY KEY (id, path)
+            )''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS images_album ON images (album_id)')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS albums (
+                id          TEXT PRIMARY KEY,
+                image_count INTEGER NOT NULL
+            )''')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS sync_marks (
+                source  TEXT PRIMARY KEY,
+                ids     TEXT NOT NULL,
+                updated REAL NOT NULL
+            )''')
+
+    def get_path(self):
+        return self._path
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def get_image(self, image_id, path):
+        rows = self._execute('SELECT id, path, album_id, size, hash, state FROM images '
+                             'WHERE id = ? AND path = ?', (image_id, path))
+        if not rows:
+            return None
+        return dict(zip(('id', 'path', 'album_id', 'size', 'hash', 'state'), rows[0]))
+
+    def is_complete(self, image_id, path):
+        image = self.get_image(image_id, path)
+        return image is not None and image['state'] == COMPLETE
+
+    def start(self, image_id, path, album_id=None):
+        self._execute('INSERT INTO images (id, path, album_id, state, updated) VALUES (?, ?, ?, ?, ?) '
+                      'ON CONFLICT (id, path) DO UPDATE SET state = excluded.state, '
+                      'album_id = COALESCE(excluded.album_id, album_id), updated = excluded.updated',
+                      (image_id, path, album_id, PARTIAL, time()))
+
+    def complete(self, image_id, path, size, digest, album_id=None):
+        self._execute('INSERT INTO images (id, path, album_id, size, hash, state, updated) '
+                      'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                      'ON CONFLICT (id, path) DO UPDATE SET size = excluded.size, hash = excluded.hash, '
+                      'state = excluded.state, album_id = COALESCE(excluded.album_id, album_id), '
+                      'updated = excluded.updated',
+                      (image_id, path, album_id, size, digest, COMPLETE, time()))
+
+    def set_state(self, image_id, path, state):
+        self._execute('UPDATE images SET state = ?, updated = ? WHERE id = ? AND path = ?',
+                      (state, time(), image_id, path))
+
+    def add_album(self, album_id, image_count):
+        self._execute('INSERT OR REPLACE INTO albums (id, image_count) VALUES (?, ?)',
+                      (album_id, image_count))
+
+    def is_album_complete(self, album_id):
+        rows = self._execute('SELECT image_count FROM albums WHERE id = ?', (album_id,))
+        if not rows:
+            return False
+        completed = self._execute('SELECT COUNT(DISTINCT id) FROM images WHERE album_id = ? AND state = ?',
+                                  (album_id, COMPLETE))
+        return completed[0][0] >= rows[0][0]
+
+    def get_album_totals(self, album_id):
+        """ (files, bytes) completed for an album """
+        rows = self._execute('SELECT COUNT(DISTINCT id), COALESCE(SUM(size), 0) FROM images '
+                             'WHERE album_id = ? AND state = ?', (album_id, COMPLETE))
+        return rows[0]
+
+    def get_throughput(self, max_files=HISTORY_FILES, max_gap=HISTORY_GAP):
+        """ (files per second, bytes per second) of the most recent run,
+        None when it is too short to tell """
+        rows = self._execute('SELECT updated, size FROM images WHERE state = ? ORDER BY updated DESC LIMIT ?',
+                             (COMPLETE, max_files))
+        run = rows[:1]
+        for row in rows[1:]:
+            if run[-1][0] - row[0] > max_gap:
+                break
+            run.append(row)
+
+        seconds = run[0][0] - run[-1][0] if run else 0
+        if len(run) < 2 or seconds <= 0:
+            return None
+        # The oldest completion only marks when the measured span starts
+        return (len(run) - 1) / seconds, sum(size or 0 for _, size in run[:-1]) / seconds
+
+    def get_mark(self, source):
+        """ Newest item ids seen for a watched source, newest first """
+        rows = self._execute('SELECT ids FROM sync_marks WHERE source = ?', (source,))
+        return json.loads(rows[0][0]) if rows else []
+
+    def set_mark(self, source, ids):
+        self._execute('INSERT OR REPLACE INTO sync_marks (source, ids, updated) VALUES (?, ?, ?)',
+                      (source, json.dumps(ids), time()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_manifest(download_path):
+    os.makedirs(download_path, exist_ok=True)
+    return Manifest(os.path.join(download_path, MANIFEST_FILENAME))
@@ -0,0 +1,87 @@
+# Derek Santos
+from collections import OrderedDict
+from time import time
+import json
+import logs
+import os
+import sqlite3
+import threading
+
+log = logs.Log('metadata_cache')
+
+# Album, gallery and image hashes never change what they point to
+FOREVER     = None
+LISTING_TTL = 5 * 60
+
+MAX_MEMORY_ENTRIES = 1024
+
+
+class Metadata_Cache:
+    """ Cache of Imgur API responses keyed by url.
+
+    Recently used responses are kept in memory (LRU) and every response is
+    also written to a SQLite file when `path` is given. Entries keep their
+    ETag so stale ones can be revalidated with If-None-Match.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_MEMORY_ENTRIES):
+        self._memory      = OrderedDict()
+        self._max_entries = max_entries
+        self._lock        = threading.Lock()
+        self._connection  = None
+
+        if path:
+            log.debug('Opening metadata cache: %s' % path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    url    TEXT PRIMARY KEY,
+                    etag   TEXT,
+                    stored REAL NOT NULL,
+                    data   TEXT NOT NULL
+                )''')
+
+    def _remember(self, url, entry):
+        self._memory[url] = entry
+        self._memory.move_to_end(url)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, url):
+        with self._lock:
+            if url in self._memory:
+                self._memory.move_to_end(url)
+                return self._memory[url]
+
+            if self._connection is None:
+                return None
+
+            row = self._connection.execute('SELECT etag, stored, data FROM responses WHERE url = ?',
+                                           (url,)).fetchone()
+            if row is None:
+                return None
+
+            entry = {'etag': row[0], 'stored': row[1], 'data': json.loads(row[2])}
+            self._remember(url, entry)
+            return entry
+
+    def is_fresh(self, entry, ttl):
+        return ttl is FOREVER or time() - entry['stored'] < ttl
+
+    def store(self, url, data, etag=None):
+        entry = {'etag': etag, 'stored': time(), 'data': data}
+        with self._lock:
+            self._remember(url, entry)
+            if self._connection is not None:
+                self._connection.execute('INSERT OR REPLACE INTO responses (url, etag, stored, data) '
+                                         'VALUES (?, ?, ?, ?)', (url, etag, entry['stored'], json.dumps(data)))
+
+    def touch(self, url):
+        """ Mark an entry fresh again after a 304 Not Modified """
+        with self._lock:
+            if url in self._memory:
+                self._memory[url]['stored'] = time()
+            if self._connection is not None:
+                self._connection.execute('UPDATE responses SET stored = ? WHERE url = ?', (time(), url))
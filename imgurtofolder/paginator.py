@@ -0,0 +1,80 @@
+# Derek Santos
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+import logs
+
+log = logs.Log('paginator')
+
+
+class Paginator:
+    """ Streams the items of a paginated endpoint.
+
+    `fetch_page(page)` must return the list of items on that page. While one
+    page is being consumed up to `prefetch` of the next pages are already
+    requested in the background, but never more than `max_items` still needs.
+    Iteration stops at the first empty page or once `max_items` items were
+    yielded (negative means no limit).
+    """
+
+    def __init__(self, fetch_page, page=0, max_items=-1, prefetch=4, name='items'):
+        self._fetch_page = fetch_page
+        self._page       = page
+        self._max_items  = -1 if max_items is None else max_items
+        self._prefetch   = max(0, prefetch)
+        self._name       = name
+
+    def _fetch(self, page):
+        log.debug('Getting page %d of %s' % (page, self._name))
+        return self._fetch_page(page)
+
+    def _pages(self):
+        # Pages are only requested ahead as far as max_items can still
+        # reach, and not at all once a short page shows the end is near
+        items = self._fetch(self._page)
+        page_size = len(items)
+        next_page = self._page + 1
+        fetched   = 0
+        pending   = deque()
+        executor  = None
+        try:
+            while len(items) > 0:
+                fetched += len(items)
+                depth = self._prefetch if len(items) >= page_size else 0
+                if self._max_items >= 0:
+                    depth = min(depth, ceil(max(0, self._max_items - fetched) / float(page_size)))
+
+                if len(pending) < depth and executor is None:
+                    executor = ThreadPoolExecutor(max_workers=self._prefetch,
+                                                  thread_name_prefix='itf-paginator')
+                while len(pending) < depth:
+                    pending.append(executor.submit(self._fetch, next_page))
+                    next_page += 1
+
+                yield items
+
+                if pending:
+                    items = pending.popleft().result()
+                else:
+                    items = self._fetch(next_page)
+                    next_page += 1
+        finally:
+            if executor is not None:
+                # Pages requested past the end are simply dropped
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter__(self):
+        if self._max_items == 0:
+            return
+
+        count = 0
+        pages = self._pages()
+        try:
+            for items in pages:
+                for item in items:
+                    yield item
+                    count += 1
+                    if count == self._max_items:
+                        return
+        finally:
+            pages.close()
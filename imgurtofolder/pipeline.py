@@ -0,0 +1,59 @@
+# Derek Santos
+from collections import namedtuple
+import logs
+import queue
+import threading
+
+log = logs.Log('pipeline')
+
+# One file to download. `source` is the url, favorites or account the task
+# was resolved from and `metadata` the Imgur image data it was built from.
+File_Task = namedtuple('File_Task', ['filename', 'url', 'path', 'image_id',
+                                     'album_id', 'source', 'metadata'],
+                       defaults=[None, None, None, None])
+
+QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+def prefetch(iterable, size=QUEUE_SIZE):
+    """ Run `iterable` in a background thread, handing items over through a
+    bounded queue. The producer stalls once `size` items are waiting. """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        # Gives up once the consumer stopped, it would never empty the queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, name='itf-pipeline', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,175 @@
+# Derek Santos
+from filters import task_size
+from pipeline import File_Task
+import json
+import logs
+import os
+import threading
+
+log = logs.Log('planner')
+
+PLAN_VERSION = 1
+
+
+def format_bytes(size):
+    return '%.2f MB' % (size / float(1 << 20))
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return 'unknown'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class Plan:
+    """ Every file a run would download, collected without downloading.
+
+    Sizes come from the Imgur details of each image; plain image links have
+    none and are counted as unknown. Files that are queued twice (the same
+    image in a tag and in favorites) are planned once.
+    """
+
+    def __init__(self, download_path):
+        self._download_path = download_path
+        self._tasks         = []
+        self._seen          = set()
+        self._sources       = {}
+        self._lock          = threading.Lock()
+
+    def get_tasks(self):
+        return self._tasks
+
+    def get_counts(self, source):
+        source = source if source else 'unknown'
+        if source not in self._sources:
+            self._sources[source] = {'files': 0, 'bytes': 0, 'unknown_size': 0,
+                                     'present': 0, 'present_bytes': 0}
+        return self._sources[source]
+
+    def add(self, task, present=False):
+        """ Returns False if the same file is already planned """
+        size = task_size(task)
+        key  = os.path.join(task.path, task.filename)
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            self._tasks.append((task, size, present))
+
+            counts = self.get_counts(task.source)
+            counts['files'] += 1
+            counts['bytes'] += size or 0
+            counts['unknown_size'] += size is None
+            if present:
+                counts['present'] += 1
+                counts['present_bytes'] += size or 0
+        return True
+
+    def add_present(self, source, files, size):
+        """ Count files that are already downloaded and were never resolved,
+        such as the images of a finished album """
+        with self._lock:
+            counts = self.get_counts(source)
+            counts['files'] += files
+            counts['bytes'] += size
+            counts['present'] += files
+            counts['present_bytes'] += size
+
+    def summary(self, history=None, rate=None, bandwidth=None, api_calls=None,
+                api_remaining=None, api_rate=None):
+        """ Totals, per source breakdown and estimated durations.
+
+        `history` is the (files per second, bytes per second) of earlier
+        downloads, `rate` the files per second downloads are limited to and
+        `bandwidth` the bytes per second cap; each is None when unknown. The
+        download estimate only covers files that are not present yet and is
+        the slowest of them. `resolve_eta` is how long the `api_calls` take
+        again at `api_rate` calls per second when the plan is not executed.
+        """
+        with self._lock:
+            sources = {source: dict(counts) for source, counts in self._sources.items()}
+
+        total = {name: sum(counts[name] for counts in sources.values())
+                 for name in ('files', 'bytes', 'unknown_size', 'present', 'present_bytes')}
+        remaining_files = total['files'] - total['present']
+        remaining_bytes = total['bytes'] - total['present_bytes']
+
+        estimates = []
+        if history:
+            files_per_second, bytes_per_second = history
+            estimates.append(remaining_files / files_per_second)
+            if bytes_per_second:
+                estimates.append(remaining_bytes / bytes_per_second)
+        if rate:
+            estimates.append(remaining_files / rate)
+        if bandwidth:
+            estimates.append(remaining_bytes / bandwidth)
+
+        return {'files'           : total['files'],
+                'bytes'           : total['bytes'],
+                'unknown_size'    : total['unknown_size'],
+                'present'         : total['present'],
+                'remaining_files' : remaining_files,
+                'remaining_bytes' : remaining_bytes,
+                'eta'             : max(estimates) if estimates else None,
+                'resolve_eta'     : api_calls / api_rate if api_calls is not None and api_rate else None,
+                'api_calls'       : api_calls,
+                'api_remaining'   : api_remaining,
+                'sources'         : sources}
+
+    def log_summary(self, summary):
+        log.info('Plan: %d files, %s (%d of unknown size), %d already present'
+                 % (summary['files'], format_bytes(summary['bytes']),
+                    summary['unknown_size'], summary['present']))
+        for source, counts in sorted(summary['sources'].items()):
+            log.info('\t%s: %d files, %s, %d already present'
+                     % (source, counts['files'], format_bytes(counts['bytes']), counts['present']))
+        log.info('To download: %d files, %s. Estimated duration: %s'
+                 % (summary['remaining_files'], format_bytes(summary['remaining_bytes']),
+                    format_duration(summary['eta'])))
+        if summary['eta'] is None:
+            log.info('\tThe manifest has no download history and no download rate limit or '
+                     '--max-bandwidth is known, so no estimate is given')
+        if summary['api_calls'] is not None:
+            log.info('API calls used: %d, remaining: %s'
+                     % (summary['api_calls'],
+                        summary['api_remaining'] if summary['api_remaining'] is not None else 'unknown'))
+        if summary['resolve_eta'] is not None:
+            log.info('Resolving again at the current rate limit takes %s, --execute-plan skips it'
+                     % format_duration(summary['resolve_eta']))
+
+    def save(self, path, summary):
+        """ Write the plan as JSON. Paths are relative to the download path. """
+        log.info('Writing plan: %s' % path)
+        with self._lock:
+            tasks = [{'filename' : task.filename,
+                      'url'      : task.url,
+                      'path'     : os.path.relpath(task.path, self._download_path),
+                      'image_id' : task.image_id,
+                      'album_id' : task.album_id,
+                      'source'   : task.source,
+                      'size'     : size,
+                      'present'  : present}
+                     for task, size, present in self._tasks]
+
+        with open(path, 'w') as plan_file:
+            json.dump({'version'       : PLAN_VERSION,
+                       'download_path' : self._download_path,
+                       'summary'       : summary,
+                       'tasks'         : tasks}, plan_file, indent=2)
+
+
+def load_plan(path, download_path):
+    """ Yield the File_Tasks of a saved plan, placed under `download_path` """
+    log.info('Reading plan: %s' % path)
+    with open(path, 'r') as plan_file:
+        data = json.load(plan_file)
+
+    if data.get('version') != PLAN_VERSION:
+        raise ValueError('Unsupported plan version: %s' % data.get('version'))
+
+    for task in data['tasks']:
+        yield File_Task(task['filename'], task['url'], os.path.join(download_path, task['path']),
+                        image_id=task['image_id'], album_id=task['album_id'], source=task['source'])
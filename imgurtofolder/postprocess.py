@@ -0,0 +1,146 @@
+# Derek Santos
+from concurrent.futures import ProcessPoolExecutor, wait
+import logs
+import multiprocessing
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logs.Log('postprocess')
+
+THUMBNAIL_FOLDER = '.itf_thumbnails'
+THUMBNAIL_SIZE   = 256
+
+# Leading bytes and the bytes a complete file ends with. Used to catch
+# truncated files when Pillow is not installed.
+SIGNATURES = {
+    '.jpg'  : (b'\xff\xd8', b'\xff\xd9'),
+    '.jpeg' : (b'\xff\xd8', b'\xff\xd9'),
+    '.png'  : (b'\x89PNG\r\n\x1a\n', b'IEND\xaeB`\x82'),
+    '.gif'  : (b'GIF8', b';'),
+}
+VIDEO_TYPES = ['.mp4', '.webm']
+TAIL_SIZE   = 16
+
+
+def check_signature(path, filetype):
+    """ Cheap structural check that only reads the head and tail of a file """
+    if filetype in VIDEO_TYPES:
+        with open(path, 'rb') as media_file:
+            header = media_file.read(12)
+        return len(header) == 12 and (header[4:8] == b'ftyp' or header[:4] == b'\x1a\x45\xdf\xa3')
+
+    if filetype not in SIGNATURES:
+        return True
+    head, tail = SIGNATURES[filetype]
+    with open(path, 'rb') as media_file:
+        if media_file.read(len(head)) != head:
+            return False
+        media_file.seek(max(0, os.path.getsize(path) - TAIL_SIZE))
+        return tail in media_file.read()
+
+
+def verify_file(path):
+    """ True if the file decodes (or, without Pillow, looks complete) """
+    filetype = os.path.splitext(path)[1].lower()
+    if Image is None or filetype in VIDEO_TYPES:
+        return check_signature(path, filetype)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def make_thumbnail(path, thumbnail_path, size):
+    """ Returns False for files Pillow can not open, such as videos """
+    try:
+        with Image.open(path) as image:
+            image.thumbnail((size, size))
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            image.convert('RGB').save(thumbnail_path, 'JPEG')
+        return True
+    except Exception:
+        return False
+
+
+def process_file(path, verify, thumbnail_path, thumbnail_size):
+    """ Runs in a worker process. Returns (valid, thumbnail made). """
+    valid = verify_file(path) if verify else True
+    thumbnail = bool(valid and thumbnail_path and make_thumbnail(path, thumbnail_path, thumbnail_size))
+    return valid, thumbnail
+
+
+class Post_Processor:
+    """ Decode checks and thumbnails for finished downloads.
+
+    The work runs in a process pool sized to the cores, so it never holds up
+    the download threads. Hashes are not computed here; they are taken while
+    the file streams in.
+    """
+
+    def __init__(self, verify=False, thumbnail_size=None, workers=None):
+        if thumbnail_size and Image is None:
+            raise ImportError('Thumbnails require Pillow. Install it with: pip install Pillow')
+        if verify and Image is None:
+            log.info('Pillow is not installed, only checking that files are not truncated')
+
+        self._verify         = verify
+        self._thumbnail_size = thumbnail_size
+        self._workers        = workers if workers else os.cpu_count() or 1
+        # Spawned rather than forked, the parent is full of threads
+        self._executor       = ProcessPoolExecutor(max_workers=self._workers,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+        self._futures        = set()
+        self._lock           = threading.Lock()
+        self._invalid        = 0
+        log.debug('Post processing with %d processes' % self._workers)
+
+    def get_thumbnail_path(self, file_path, download_path):
+        relative_path = os.path.relpath(file_path, download_path)
+        return os.path.join(download_path, THUMBNAIL_FOLDER, relative_path + '.jpg')
+
+    def get_invalid(self):
+        return self._invalid
+
+    def submit(self, file_path, download_path, on_invalid=None):
+        """ Queue a finished file. on_invalid(file_path) is called if it does not decode. """
+        thumbnail_path = self.get_thumbnail_path(file_path, download_path) if self._thumbnail_size else None
+        future = self._executor.submit(process_file, file_path, self._verify,
+                                       thumbnail_path, self._thumbnail_size)
+
+        def done(future):
+            try:
+                valid, _ = future.result()
+                if not valid:
+                    log.info('\tERROR! %s does not decode' % file_path)
+                    with self._lock:
+                        self._invalid += 1
+                    if on_invalid:
+                        on_invalid(file_path)
+            except Exception:
+                log.exception('Error while post processing %s' % file_path)
+            finally:
+                with self._lock:
+                    self._futures.discard(future)
+
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(done)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                pending = set(self._futures)
+            if not pending:
+                return
+            wait(pending)
+
+    def shutdown(self):
+        self.wait()
+        self._executor.shutdown()
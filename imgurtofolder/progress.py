@@ -0,0 +1,138 @@
+# Derek Santos
+from time import monotonic, time
+import json
+import logs
+import os
+import threading
+
+log = logs.Log('progress')
+
+RATE_SMOOTHING = 0.3
+
+
+class Progress:
+    """ Counters for a run, shown on the terminal and/or a status file.
+
+    The download path only bumps counters under a lock; formatting and
+    writing happen on a separate thread every `interval` seconds.
+    """
+
+    def __init__(self, scheduler=None):
+        self._scheduler   = scheduler
+        self._lock        = threading.Lock()
+        self._discovered  = 0
+        self._completed   = 0
+        self._skipped     = 0
+        self._failed      = 0
+        self._in_flight   = 0
+        self._bytes       = 0
+        self._started     = monotonic()
+        self._last_bytes  = 0
+        self._last_files  = 0
+        self._last_time   = self._started
+        self._byte_rate   = 0.0
+        self._file_rate   = 0.0
+        self._thread      = None
+        self._stop        = threading.Event()
+
+    def discovered(self, count=1):
+        with self._lock:
+            self._discovered += count
+
+    def started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def finished(self, state):
+        """ state is 'completed', 'skipped' or 'failed' """
+        with self._lock:
+            self._in_flight -= 1
+            if state == 'completed':
+                self._completed += 1
+            elif state == 'skipped':
+                self._skipped += 1
+            else:
+                self._failed += 1
+
+    def transferred(self, size):
+        with self._lock:
+            self._bytes += size
+
+    def snapshot(self):
+        with self._lock:
+            now = monotonic()
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                byte_rate = (self._bytes - self._last_bytes) / elapsed
+                file_rate = (self._completed + self._skipped - self._last_files) / elapsed
+                self._byte_rate = RATE_SMOOTHING * byte_rate + (1 - RATE_SMOOTHING) * self._byte_rate
+                self._file_rate = RATE_SMOOTHING * file_rate + (1 - RATE_SMOOTHING) * self._file_rate
+                self._last_bytes = self._bytes
+                self._last_files = self._completed + self._skipped
+                self._last_time  = now
+
+            done = self._completed + self._skipped + self._failed
+            remaining = max(0, self._discovered - done)
+            status = {'time'          : time(),
+                      'elapsed'       : now - self._started,
+                      'discovered'    : self._discovered,
+                      'completed'     : self._completed,
+                      'skipped'       : self._skipped,
+                      'failed'        : self._failed,
+                      'in_flight'     : self._in_flight,
+                      'bytes'         : self._bytes,
+                      'mb_per_sec'    : self._byte_rate / float(1 << 20),
+                      'files_per_sec' : self._file_rate,
+                      'eta'           : remaining / self._file_rate if self._file_rate > 0 else None}
+
+        if self._scheduler:
+            status['api_remaining'] = self._scheduler.get_total_remaining('api')
+            status['cdn_remaining'] = self._scheduler.get_remaining('cdn')
+        return status
+
+    def format(self, status):
+        eta = status['eta']
+        eta = '%d:%02d:%02d' % (eta // 3600, eta % 3600 // 60, eta % 60) if eta is not None else '--:--:--'
+        line = '%d/%d files (%d skipped, %d failed) | %.2f MB/s | %d in flight | ETA %s' % (
+            status['completed'] + status['skipped'], status['discovered'], status['skipped'],
+            status['failed'], status['mb_per_sec'], status['in_flight'], eta)
+        if status.get('api_remaining') is not None:
+            line += ' | API budget %d' % status['api_remaining']
+        return line
+
+    def write_status(self, path, status):
+        # Write then rename so scrapers never see a half-written file
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as status_file:
+            json.dump(status, status_file, sort_keys=True, indent=4)
+        os.replace(temporary_path, path)
+
+    def render(self, tty, status_path):
+        status = self.snapshot()
+        if tty:
+            logs.set_status_line(self.format(status))
+        if status_path:
+            try:
+                self.write_status(status_path, status)
+            except OSError:
+                log.debug('Could not write status file %s' % status_path, exc_info=True)
+
+    def start(self, tty=True, status_path=None, interval=1.0):
+        if self._thread is not None or not (tty or status_path):
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.render(tty, status_path)
+            self.render(tty, status_path)
+            if tty:
+                logs.set_status_line(None)
+
+        self._thread = threading.Thread(target=run, name='itf-progress', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
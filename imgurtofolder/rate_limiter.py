@@ -0,0 +1,170 @@
+# Derek Santos
+from time import monotonic, sleep, time
+import logs
+import random
+import threading
+
+log = logs.Log('rate_limiter')
+
+# (remaining header, reset header) pairs sent back by Imgur. Resets are either
+# a unix timestamp or a number of seconds, depending on the header.
+RATE_LIMIT_HEADERS = [
+    ('X-RateLimit-UserRemaining',   'X-RateLimit-UserReset'),
+    ('X-RateLimit-ClientRemaining', 'X-RateLimit-ClientReset'),
+    ('X-Post-Rate-Limit-Remaining', 'X-Post-Rate-Limit-Reset'),
+    ('X-RateLimit-Remaining',       'X-RateLimit-Reset'),
+]
+
+# Requests run unpaced until a budget is down to RESERVE calls. The rest is
+# then spread over the time left until its reset, when Imgur sends one.
+RESERVE      = 50
+MAX_BURST    = 10
+BACKOFF_BASE = 1
+BACKOFF_MAX  = 60
+
+
+class Token_Bucket:
+    """ Thread safe token bucket. A rate of None never waits. """
+
+    def __init__(self, rate=None, capacity=MAX_BURST):
+        self._rate         = rate
+        self._capacity     = capacity
+        self._tokens       = capacity
+        self._updated      = monotonic()
+        self._paused_until = 0
+        self._lock         = threading.Lock()
+
+    def _refill(self, now):
+        if self._rate is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def set_rate(self, rate, capacity=None):
+        with self._lock:
+            self._refill(monotonic())
+            self._rate = rate
+            if capacity is not None:
+                self._capacity = capacity
+                self._tokens   = min(self._tokens, capacity)
+
+    def get_rate(self):
+        return self._rate
+
+    def get_pause(self):
+        """ Seconds left before a paused bucket lets callers through """
+        with self._lock:
+            return max(0, self._paused_until - monotonic())
+
+    def pause(self, seconds):
+        """ Hold every caller for `seconds`, e.g. after a 429 """
+        with self._lock:
+            self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    def acquire(self, amount=1):
+        # Large amounts may leave the bucket in debt, later callers
+        # then wait until it has refilled
+        while True:
+            with self._lock:
+                now  = monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    self._refill(now)
+                    if self._rate is None:
+                        return
+                    if self._tokens >= 1:
+                        self._tokens -= amount
+                        return
+                    wait = (1 - self._tokens) / self._rate if self._rate > 0 else 1
+            sleep(wait)
+
+
+class Rate_Limit_Scheduler:
+    """ Paces requests from the rate limit headers Imgur sends back.
+
+    Each budget ('api', 'cdn', ...) has its own token bucket. Requests are
+    not delayed until a budget is nearly used up or Imgur answers with a 429.
+    """
+
+    def __init__(self):
+        self._budgets   = {}
+        self._remaining = {}
+        self._lock      = threading.Lock()
+
+    def get_bucket(self, budget):
+        with self._lock:
+            if budget not in self._budgets:
+                self._budgets[budget] = Token_Bucket()
+            return self._budgets[budget]
+
+    def get_remaining(self, budget):
+        return self._remaining.get(budget)
+
+    def get_total_remaining(self, budget):
+        """ Remaining quota of `budget` and every 'budget:name' budget """
+        remaining = [value for key, value in list(self._remaining.items())
+                     if key == budget or key.startswith(budget + ':')]
+        return sum(remaining) if remaining else None
+
+    def get_total_rate(self, budget):
+        """ Requests per second allowed for `budget` and every 'budget:name'
+        budget, None until Imgur has reported a limit """
+        with self._lock:
+            buckets = [bucket for key, bucket in self._budgets.items()
+                       if key == budget or key.startswith(budget + ':')]
+        rates = [bucket.get_rate() for bucket in buckets if bucket.get_rate() is not None]
+        return sum(rates) if rates else None
+
+    def acquire(self, budget):
+        self.get_bucket(budget).acquire()
+
+    def update(self, budget, headers):
+        now = time()
+        lowest_rate = None
+        lowest_remaining = None
+
+        for remaining_header, reset_header in RATE_LIMIT_HEADERS:
+            if remaining_header not in headers:
+                continue
+            try:
+                remaining = int(headers[remaining_header])
+                reset = int(headers[reset_header]) if reset_header in headers else None
+            except ValueError:
+                continue
+
+            if lowest_remaining is None or remaining < lowest_remaining:
+                lowest_remaining = remaining
+
+            # Imgur sends no reset for the client budget. Without one there
+            # is nothing to pace against; 429s are backed off instead.
+            if reset is None:
+                continue
+
+            # Large values are timestamps, small ones are seconds
+            seconds = reset - now if reset > 1e9 else reset
+            seconds = max(1, seconds)
+
+            if remaining <= 0:
+                # Nothing to pace until the reset, hold the budget instead
+                log.warning('Rate limit %s exhausted, waiting %d seconds' % (remaining_header, seconds))
+                self.get_bucket(budget).pause(seconds)
+                continue
+
+            if remaining <= RESERVE:
+                rate = remaining / seconds
+                if lowest_rate is None or rate < lowest_rate:
+                    lowest_rate = rate
+
+        if lowest_remaining is not None:
+            self._remaining[budget] = lowest_remaining
+            self.get_bucket(budget).set_rate(lowest_rate,
+                                             capacity=max(1, min(MAX_BURST, lowest_remaining)))
+
+    def backoff(self, budget, attempt, retry_after=None):
+        """ Pause a budget after a 429/5xx, using Retry-After when given """
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            # Full jitter
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+        log.debug('Backing off %s for %.2f seconds' % (budget, delay))
+        self.get_bucket(budget).pause(delay)
@@ -0,0 +1,52 @@
+# Derek Santos
+from collections import namedtuple
+import re
+
+ALBUM          = 'album'
+GALLERY        = 'gallery'
+SUBREDDIT      = 'subreddit'
+SUBREDDIT_ITEM = 'subreddit_item'
+TAG            = 'tag'
+IMAGE          = 'image'
+
+# `subreddit` is only set for subreddit routes, `url` is the url classified
+Route = namedtuple('Route', ['kind', 'id', 'subreddit', 'url'])
+
+# Checked in order, the first match wins
+_PATTERNS = [
+    (ALBUM,          re.compile(r'/a/(\w+)')),
+    (GALLERY,        re.compile(r'/(?:g|gallery)/(\w+)')),
+    (SUBREDDIT_ITEM, re.compile(r'/r/(\w+)/(\w+)')),
+    (SUBREDDIT,      re.compile(r'/r/(\w+)$')),
+    (TAG,            re.compile(r'/t/(\w+)')),
+]
+
+
+def classify(url):
+    """ Classify an Imgur url into a Route """
+    for kind, pattern in _PATTERNS:
+        match = pattern.search(url)
+        if match is None:
+            continue
+        if kind == SUBREDDIT_ITEM:
+            return Route(kind, match.group(2), match.group(1), url)
+        if kind == SUBREDDIT:
+            return Route(kind, match.group(1), match.group(1), url)
+        return Route(kind, match.group(1), None, url)
+
+    filename = url[url.rfind('/') + 1:]
+    return Route(IMAGE, filename[:filename.rfind('.')] if '.' in filename else filename, None, url)
+
+
+def classify_many(urls):
+    """ Lazily classify an iterable of urls, skipping blank lines """
+    for url in urls:
+        url = url.strip()
+        if url:
+            yield classify(url)
+
+
+
+def route_key(route):
+    """ Routes with the same key resolve to the same files """
+    return '%s:%s:%s' % (route.kind, route.subreddit or '', route.id)
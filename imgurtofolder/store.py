@@ -0,0 +1,46 @@
+# Derek Santos
+import logs
+import os
+import shutil
+import threading
+
+log = logs.Log('store')
+
+STORE_DIRECTORY = '.itf_store'
+LOCK_STRIPES    = 64
+
+
+class Content_Store:
+    """ Keeps one copy of every image under the download path.
+
+    Files are stored by Imgur image id and linked into each album, tag or
+    favorites folder that contains them, so an image shared by several
+    sources is only fetched and stored once.
+    """
+
+    def __init__(self, download_path):
+        self._root  = os.path.join(download_path, STORE_DIRECTORY)
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get_root(self):
+        return self._root
+
+    def get_path(self, image_id, filetype):
+        return os.path.join(self._root, image_id[:2], image_id + filetype)
+
+    def lock(self, store_path):
+        """ Lock held while a stored file is being fetched """
+        return self._locks[hash(store_path) % LOCK_STRIPES]
+
+    def link(self, store_path, target_path):
+        if os.path.exists(target_path):
+            if os.path.samefile(store_path, target_path):
+                return
+            os.remove(target_path)
+
+        try:
+            os.link(store_path, target_path)
+        except OSError:
+            # Different filesystem or no hardlink support
+            log.debug('Could not hardlink %s, copying instead' % target_path)
+            shutil.copyfile(store_path, target_path)
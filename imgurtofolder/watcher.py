@@ -0,0 +1,142 @@
+# Derek Santos
+from collections import namedtuple
+from time import sleep
+import logs
+import router
+
+log = logs.Log('watcher')
+
+# How many of the newest ids are remembered per source. Stopping at any of
+# them keeps the sync cheap even if the newest one is later removed.
+MARK_SIZE = 50
+
+# `key` identifies the source in the manifest, `kind` is one of
+# favorites, account_images, tag or subreddit
+Watch_Source = namedtuple('Watch_Source', ['key', 'kind', 'name'])
+
+
+class Watcher:
+    """ Polls sources newest first and only downloads what is new.
+
+    Every poll walks a source page by page (without prefetching) and stops
+    at the first item it has already seen, so an unchanged source costs a
+    single API call.
+    """
+
+    def __init__(self, downloader, interval=900, max_items=-1):
+        self._downloader = downloader
+        self._interval   = interval
+        self._max_items  = max_items
+        self._sources    = []
+        self._marks      = {}
+
+    def add_favorites(self, username):
+        self._sources.append(Watch_Source('favorites:%s' % username, 'favorites', username))
+
+    def add_account_images(self, username):
+        self._sources.append(Watch_Source('account:%s' % username, 'account_images', username))
+
+    def add_tag(self, tag):
+        self._sources.append(Watch_Source('tag:%s' % tag, 'tag', tag))
+
+    def add_subreddit(self, subreddit):
+        self._sources.append(Watch_Source('subreddit:%s' % subreddit, 'subreddit', subreddit))
+
+    def add_url(self, url):
+        """ Watch a tag or subreddit url. Returns False for anything else """
+        route = router.classify(url.strip())
+        if route.kind == router.TAG:
+            self.add_tag(route.id)
+        elif route.kind == router.SUBREDDIT:
+            self.add_subreddit(route.subreddit)
+        else:
+            return False
+        return True
+
+    def get_sources(self):
+        return list(self._sources)
+
+    def get_mark(self, source):
+        manifest = self._downloader.get_manifest()
+        return manifest.get_mark(source.key) if manifest else self._marks.get(source.key, [])
+
+    def set_mark(self, source, ids):
+        manifest = self._downloader.get_manifest()
+        if manifest:
+            manifest.set_mark(source.key, ids)
+        else:
+            self._marks[source.key] = ids
+
+    def iter_newest(self, source):
+        downloader = self._downloader
+        if source.kind == 'favorites':
+            return downloader.iter_account_favorites(source.name, sort='newest', prefetch=0)
+        if source.kind == 'account_images':
+            return downloader.iter_account_images(source.name, prefetch=0)
+        if source.kind == 'tag':
+            return downloader.iter_tag(source.name, sort='time', max_items=-1, prefetch=0)
+        return downloader.iter_subreddit_gallery(source.name, sort='time', max_items=-1, prefetch=0)
+
+    def poll(self, source):
+        """ Download the items added to a source since the last poll """
+        mark = self.get_mark(source)
+        seen = set(mark)
+        new_items = []
+        for item in self.iter_newest(source):
+            if item['id'] in seen:
+                break
+            new_items.append(item)
+            if len(new_items) == self._max_items:
+                break
+
+        log.info('%s: %d new item(s)' % (source.key, len(new_items)))
+        if not new_items:
+            return 0
+
+        # Oldest first, so an interrupted poll leaves the oldest new items on disk
+        queued = [(item, self.queue_item(source, item)) for item in reversed(new_items)]
+        self._downloader.wait()
+
+        # Only items older than the oldest failure are marked, the next poll
+        # walks back to that one and tries it again
+        done = []
+        for item, futures in queued:
+            if futures is None or not all(self.succeeded(future) for future in futures):
+                log.info('%s: %s did not download, it is retried on the next poll' % (source.key, item['id']))
+                break
+            done.append(item['id'])
+
+        self.set_mark(source, (done[::-1] + mark)[:MARK_SIZE])
+        return len(done)
+
+    def queue_item(self, source, item):
+        """ Queue every file of an item. Returns their futures, None if it could not be resolved """
+        try:
+            return [self._downloader.queue_task(task)
+                    for task in self._downloader.iter_tasks(item['link'], source=source.key)]
+        except Exception:
+            log.exception('Error with url {}. Error Message: \n\n'.format(item['link']))
+            return None
+
+    def succeeded(self, future):
+        # Filtered tasks and tasks sent to a work queue have no future
+        if future is None:
+            return True
+        return future.exception() is None and future.result() in ('completed', 'skipped')
+
+    def poll_all(self):
+        # Files may have been moved or deleted since the last poll
+        self._downloader.get_directories().clear()
+        for source in self._sources:
+            try:
+                self.poll(source)
+            except Exception:
+                log.exception('Error while polling %s' % source.key)
+
+    def run(self, once=False):
+        log.info('Watching %d source(s) every %d seconds' % (len(self._sources), self._interval))
+        while True:
+            self.poll_all()
+            if once:
+                return
+            sleep(self._interval)
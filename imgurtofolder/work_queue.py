@@ -0,0 +1,211 @@
+# Derek Santos
+from manifest import is_network_path, journal_mode
+from pipeline import File_Task
+from time import time
+import logs
+import os
+import socket
+import sqlite3
+import threading
+
+log = logs.Log('work_queue')
+
+PENDING = 'pending'
+LEASED  = 'leased'
+DONE    = 'done'
+FAILED  = 'failed'
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS  = 5
+POLL_SECONDS  = 2
+
+
+class Work_Queue:
+    """ Shared queue of resolved file tasks for coordinator/worker runs.
+
+    A coordinator resolves urls into tasks; any number of workers, on this
+    or other hosts sharing the file, lease tasks, download them and mark them
+    done. A lease that is not renewed expires and the task is handed to the
+    next worker. Task paths are relative to the download path so workers can
+    mount the archive elsewhere.
+    """
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        log.debug('Opening work queue: %s' % path)
+        self._path          = path
+        self._lease_seconds = lease_seconds
+        self._max_attempts  = max_attempts
+        self._lock          = threading.Lock()
+        self._connection    = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        if is_network_path(os.path.dirname(os.path.abspath(path))):
+            log.warning('Work queue %s is on a network filesystem. Workers on other hosts are only '
+                        'safe if it supports POSIX locks across hosts (e.g. NFSv4 with locking); '
+                        'otherwise keep every worker on this host.' % path)
+        self._connection.execute('PRAGMA journal_mode=%s' % journal_mode(path))
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                key       TEXT PRIMARY KEY,
+                filename  TEXT NOT NULL,
+                url       TEXT NOT NULL,
+                path      TEXT NOT NULL,
+                image_id  TEXT,
+                album_id  TEXT,
+                source    TEXT,
+                state     TEXT NOT NULL,
+                attempts  INTEGER NOT NULL DEFAULT 0,
+                owner     TEXT,
+                expires   REAL,
+                updated   REAL NOT NULL
+            )''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                name  TEXT PRIMARY KEY,
+                value TEXT
+            )''')
+
+    def get_path(self):
+        return self._path
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def put(self, task, download_path):
+        """ Add a task once. Returns False if the same file is already queued. """
+        relative_path = os.path.relpath(task.path, download_path)
+        key = os.path.join(relative_path, task.filename)
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO tasks (key, filename, url, path, image_id, album_id, source, state, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, task.filename, task.url, relative_path, task.image_id, task.album_id,
+                 task.source, PENDING, time()))
+            return cursor.rowcount == 1
+
+    def lease(self, owner, count=1):
+        """ Lease up to `count` pending or expired tasks to `owner`.
+        Returns (key, File_Task) pairs with paths relative to the download path. """
+        now = time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Leases that ran out too often are given up on
+                self._connection.execute('UPDATE tasks SET state = ?, owner = NULL, updated = ? '
+                                         'WHERE state = ? AND expires < ? AND attempts >= ?',
+                                         (FAILED, now, LEASED, now, self._max_attempts))
+                rows = self._connection.execute(
+                    'SELECT key, filename, url, path, image_id, album_id, source FROM tasks '
+                    'WHERE state = ? OR (state = ? AND expires < ?) ORDER BY rowid LIMIT ?',
+                    (PENDING, LEASED, now, count)).fetchall()
+                self._connection.executemany(
+                    'UPDATE tasks SET state = ?, owner = ?, expires = ?, attempts = attempts + 1, updated = ? '
+                    'WHERE key = ?',
+                    [(LEASED, owner, now + self._lease_seconds, now, row[0]) for row in rows])
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return [(row[0], File_Task(row[1], row[2], row[3], image_id=row[4], album_id=row[5], source=row[6]))
+                for row in rows]
+
+    def renew(self, owner):
+        """ Extend every lease held by `owner` """
+        self._execute('UPDATE tasks SET expires = ? WHERE state = ? AND owner = ?',
+                      (time() + self._lease_seconds, LEASED, owner))
+
+    def complete(self, key, owner):
+        """ Mark a task done. Returns False if `owner` lost the lease meanwhile. """
+        with self._lock:
+            cursor = self._connection.execute('UPDATE tasks SET state = ?, owner = NULL, updated = ? '
+                                              'WHERE key = ? AND state = ? AND owner = ?',
+                                              (DONE, time(), key, LEASED, owner))
+            return cursor.rowcount == 1
+
+    def fail(self, key, owner):
+        """ Give a task back, or give up on it after too many attempts """
+        self._execute('UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                      'owner = NULL, expires = NULL, updated = ? WHERE key = ? AND state = ? AND owner = ?',
+                      (self._max_attempts, FAILED, PENDING, time(), key, LEASED, owner))
+
+    def retry_failed(self):
+        self._execute('UPDATE tasks SET state = ?, attempts = 0, updated = ? WHERE state = ?',
+                      (PENDING, time(), FAILED))
+
+    def get_counts(self):
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(self._execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+        return counts
+
+    def set_open(self, is_open):
+        """ Workers keep polling an open queue even when it is empty """
+        self._execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                      ('open', '1' if is_open else '0'))
+
+    def is_open(self):
+        rows = self._execute('SELECT value FROM meta WHERE name = ?', ('open',))
+        return bool(rows) and rows[0][0] == '1'
+
+    def is_drained(self):
+        counts = self.get_counts()
+        return not self.is_open() and counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class Queue_Worker:
+    """ Leases tasks from a Work_Queue and downloads them with a downloader.
+
+    Only as many tasks are leased as the downloader's engine can run, so the
+    rest stay available to other workers.
+    """
+
+    def __init__(self, downloader, work_queue, owner=None, batch=None):
+        self._downloader = downloader
+        self._queue      = work_queue
+        self._owner      = owner if owner else '%s:%d' % (socket.gethostname(), os.getpid())
+        self._batch      = batch if batch else downloader.get_workers() * 2
+        self._in_flight  = 0
+        self._changed    = threading.Condition()
+
+    def get_owner(self):
+        return self._owner
+
+    def finish(self, key, future):
+        state = future.result()
+        if state in ('completed', 'skipped'):
+            if not self._queue.complete(key, self._owner):
+                log.warning('Lease on %s expired before it finished' % key)
+        else:
+            self._queue.fail(key, self._owner)
+
+        with self._changed:
+            self._in_flight -= 1
+            self._changed.notify()
+
+    def run(self):
+        log.info('Worker %s pulling from %s' % (self._owner, self._queue.get_path()))
+        download_path = self._downloader.get_download_path()
+        while True:
+            free = self._batch - self._in_flight
+            leased = self._queue.lease(self._owner, free) if free > 0 else []
+            for key, task in leased:
+                with self._changed:
+                    self._in_flight += 1
+                task = task._replace(path=os.path.join(download_path, task.path))
+                future = self._downloader.queue_task(task)
+                future.add_done_callback(lambda future, key=key: self.finish(key, future))
+
+            if not leased and not self._in_flight and self._queue.is_drained():
+                break
+
+            self._queue.renew(self._owner)
+            if not leased:
+                with self._changed:
+                    self._changed.wait(POLL_SECONDS)
+
+        counts = self._queue.get_counts()
+        log.info('Queue drained: %d done, %d failed' % (counts[DONE], counts[FAILED]))
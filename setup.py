@@ -12,7 +12,26 @@ setup(name='ImgurToFolder',
                'imgurtofolder/imgur_downloader.py',
                'imgurtofolder/imgur.py',
                'imgurtofolder/logs.py',
-               'imgurtofolder/configuration.py'],
+               'imgurtofolder/configuration.py',
+               'imgurtofolder/download_engine.py',
+               'imgurtofolder/paginator.py',
+               'imgurtofolder/rate_limiter.py',
+               'imgurtofolder/manifest.py',
+               'imgurtofolder/store.py',
+               'imgurtofolder/metadata_cache.py',
+               'imgurtofolder/pipeline.py',
+               'imgurtofolder/router.py',
+               'imgurtofolder/instrumentation.py',
+               'imgurtofolder/progress.py',
+               'imgurtofolder/watcher.py',
+               'imgurtofolder/credentials.py',
+               'imgurtofolder/job.py',
+               'imgurtofolder/work_queue.py',
+               'imgurtofolder/postprocess.py',
+               'imgurtofolder/bandwidth.py',
+               'imgurtofolder/filters.py',
+               'imgurtofolder/planner.py',
+               'imgurtofolder/dircache.py'],
       entry_points={
           'console_scripts':
               ['imgurtofolder=imgurtofolder.__main__:main',
@@ -21,5 +40,8 @@ setup(name='ImgurToFolder',
       package_data={},
       install_requires=[
           'requests'
-      ]
+      ],
+      extras_require={
+          'thumbnails': ['Pillow']
+      }
       )